@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
 from cms.apphook_pool import apphook_pool
+from cms.cache.page_resolver import get_routing_index
 from cms.utils.i18n import force_language, get_language_list
 from cms.models.pagemodel import Page
 
@@ -16,9 +17,38 @@ from django.utils.translation import get_language
 
 APP_RESOLVERS = []
 
+# Per language prefix tries over the title paths apphooks are attached to,
+# pointing to the matching resolvers in APP_RESOLVERS.
+APP_RESOLVER_TRIES = {}
+
+# Resolvers for the urlconfs of apphooks, used by the details view to serve
+# the page an apphook is attached to. Keyed by (apphook name, language).
+APP_URL_RESOLVERS = {}
+
 def clear_app_resolvers():
-    global APP_RESOLVERS
+    global APP_RESOLVERS, APP_RESOLVER_TRIES
     APP_RESOLVERS = []
+    APP_RESOLVER_TRIES = {}
+    clear_app_url_resolvers()
+
+def clear_app_url_resolvers(**kwargs):
+    APP_URL_RESOLVERS.clear()
+
+def get_app_url_resolver(app_name):
+    """
+    Returns a resolver over all urlconfs of the apphook ``app_name``, compiled
+    once per language instead of on every request.
+    """
+    key = (app_name, get_language())
+    resolver = APP_URL_RESOLVERS.get(key)
+    if resolver is None:
+        app = apphook_pool.get_apphook(app_name)
+        pattern_list = []
+        for urlpatterns in get_app_urls(app.urls):
+            pattern_list += urlpatterns
+        resolver = RegexURLResolver(r'^/', patterns('', *pattern_list))
+        APP_URL_RESOLVERS[key] = resolver
+    return resolver
 
 def applications_page_check(request, current_page=None, path=None):
     """Tries to find if given path was resolved over application.
@@ -34,19 +64,72 @@ def applications_page_check(request, current_page=None, path=None):
     for lang in get_language_list():
         if path.startswith(lang + "/"):
             path = path[len(lang + "/"):]
-    for resolver in APP_RESOLVERS:
+    trie = APP_RESOLVER_TRIES.get(get_language())
+    if trie is None:
+        return None
+    # only try the resolvers of apphooks attached to a prefix of the path
+    for resolver in trie.get_resolvers(path):
         try:
             page_id = resolver.resolve_page_id(path)
-            # yes, it is application page
-            page = Page.objects.public().get(id=page_id)
-            # If current page was matched, then we have some override for content
-            # from cms, but keep current page. Otherwise return page to which was application assigned.
-            return page
         except Resolver404:
             # Raised if the page is not managed by an apphook
-            pass
+            continue
+        # yes, it is application page
+        return _get_public_page(page_id)
     return None
 
+
+def _get_public_page(page_id):
+    index = get_routing_index(Site.objects.get_current().pk, draft=False)
+    if index is not None:
+        # reuses the Page instances the routing index keeps per process
+        try:
+            return index.get_page(page_id)
+        except Page.DoesNotExist:
+            pass
+    return Page.objects.public().get(id=page_id)
+
+
+class AppResolverTrie(object):
+    """
+    Prefix tree over the path segments of the titles apphooks are attached
+    to, so a request path only has to be matched against the resolvers of
+    its own ancestors instead of against all of them.
+
+    The resolvers are tried in the order they were added, like the patterns
+    of a urlconf, so overlapping apphooks resolve the same way as when
+    trying all of them.
+    """
+    def __init__(self):
+        self.children = {}
+        self.resolvers = []
+        self.positions = {}
+
+    def add(self, path, resolver):
+        position = self.positions.setdefault(resolver, len(self.positions))
+        node = self
+        for bit in path.split('/'):
+            if bit:
+                node = node.children.setdefault(bit, AppResolverTrie())
+        if (position, resolver) not in node.resolvers:
+            node.resolvers.append((position, resolver))
+
+    def get_resolvers(self, path):
+        """
+        Returns the resolvers attached to prefixes of ``path``, in the order
+        they were added.
+        """
+        found = list(self.resolvers)
+        node = self
+        for bit in path.split('/'):
+            if not bit:
+                continue
+            node = node.children.get(bit)
+            if node is None:
+                break
+            found.extend(node.resolvers)
+        return [resolver for position, resolver in sorted(found)]
+
 class AppRegexURLResolver(RegexURLResolver):
 
     def __init__(self, *args, **kwargs):
@@ -203,19 +286,23 @@ def get_app_patterns():
         else:
             app_ns = None, None
         with force_language(title.language):
-            hooked_applications[title.page_id][title.language] = (app_ns, get_patterns_for_title(path, title))
+            hooked_applications[title.page_id][title.language] = (
+                app_ns, get_patterns_for_title(path, title), title.path)
         included.append(mix_id)
     # Build the app patterns to be included in the cms urlconfs
     app_patterns = []
     for page_id in hooked_applications.keys():
         resolver = None
         for lang in hooked_applications[page_id].keys():
-            (app_ns, inst_ns), current_patterns = hooked_applications[page_id][lang]
+            (app_ns, inst_ns), current_patterns, title_path = hooked_applications[page_id][lang]
             if not resolver:
                 resolver = AppRegexURLResolver(r'', 'app_resolver', app_name=app_ns, namespace=inst_ns)
                 resolver.page_id = page_id
             extra_patterns = patterns('', *current_patterns)
             resolver.url_patterns_dict[lang] = extra_patterns
+            if lang not in APP_RESOLVER_TRIES:
+                APP_RESOLVER_TRIES[lang] = AppResolverTrie()
+            APP_RESOLVER_TRIES[lang].add(title_path, resolver)
         app_patterns.append(resolver)
         APP_RESOLVERS.append(resolver)
     return app_patterns
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.cache import cache
+
+
+def _new_generation():
+    # Generations start from the current time rather than from 1, so a
+    # counter that got evicted from the cache never comes back with a value
+    # an in-process copy was already built against.
+    return int(time.time() * 1000)
+
+
+def get_cache_generation(key, duration):
+    """
+    Returns the generation stored under ``key`` in the shared cache,
+    initialising it if needed. Returns None if the cache backend does not
+    keep values (e.g. the dummy backend), in which case callers must not
+    rely on in-process copies of cached data.
+    """
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), duration)
+        generation = cache.get(key)
+    return generation
+
+
+def get_cache_generations(keys, duration):
+    """
+    Like get_cache_generation, for several keys at once. Returns a list of
+    generations in the order of ``keys``, or None if the cache backend does
+    not keep values.
+    """
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if generations.get(key) is None]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_generation(), duration)
+        generations.update(cache.get_many(missing))
+        if any(generations.get(key) is None for key in missing):
+            return None
+    return [generations[key] for key in keys]
+
+
+def bump_cache_generation(key, duration):
+    """
+    Invalidates everything built against the generation stored under ``key``.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key is not in the cache (anymore)
+        cache.set(key, _new_generation(), duration)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import calendar
+import hashlib
+import time
+
+from cms.cache import get_cache_generation, bump_cache_generation
+from cms.utils import get_cms_setting
+from django.core.cache import cache
+
+
+def get_cache_version_key():
+    return "%s:page_cache:version" % get_cms_setting('CACHE_PREFIX')
+
+
+def get_cache_version():
+    return get_cache_generation(get_cache_version_key(),
+                                get_cms_setting('CACHE_DURATIONS')['menus'])
+
+
+def get_last_change_key():
+    return "%s:page_cache:changed" % get_cms_setting('CACHE_PREFIX')
+
+
+def get_last_change():
+    """
+    Returns the (unix) time of the last change invalidating the page cache,
+    or None if the cache backend does not keep values.
+    """
+    key = get_last_change_key()
+    last_change = cache.get(key)
+    if last_change is None:
+        # unknown (e.g. evicted), so anything may have changed
+        cache.add(key, int(time.time()), get_cms_setting('CACHE_DURATIONS')['menus'])
+        last_change = cache.get(key)
+    return last_change
+
+
+def invalidate_page_cache():
+    """
+    Invalidates all cached page responses.
+    """
+    bump_cache_generation(get_cache_version_key(),
+                          get_cms_setting('CACHE_DURATIONS')['menus'])
+    cache.set(get_last_change_key(), int(time.time()), get_cms_setting('CACHE_DURATIONS')['menus'])
+
+
+def get_page_validators(request, page, language):
+    """
+    Returns the ETag and Last-Modified (unix time) of the rendered page, or
+    None for validators that can't be determined.
+
+    Pages render menus and other pages' content, so the last change of the
+    site is taken into account as well as the change date of the page itself.
+    """
+    version = get_cache_version()
+    last_change = get_last_change()
+    if version is None or last_change is None:
+        return None, None
+    last_modified = max(calendar.timegm(page.changed_date.utctimetuple()), last_change)
+    etag = hashlib.md5(("%s:%s:%s:%s:%s" % (
+        page.pk, language, version, last_modified, request.path)).encode('utf-8')).hexdigest()
+    if last_modified >= int(time.time()):
+        # http dates have a resolution of one second, another change within
+        # the current second would not be noticed
+        last_modified = None
+    return etag, last_modified
+
+
+def is_page_cache_enabled(template=None):
+    """
+    CMS_PAGE_CACHE is either True (cache pages of all templates) or a list of
+    templates whose pages may be cached.
+    """
+    setting = get_cms_setting('PAGE_CACHE')
+    if setting is True or not setting:
+        return bool(setting)
+    if template is None:
+        return True
+    return template in setting
+
+
+def get_page_cache_key(request, site_id, language):
+    toolbar = getattr(request, 'toolbar', None)
+    show_toolbar = bool(toolbar and toolbar.show_toolbar)
+    return "%s:page_cache:%s:%s:%d:%s" % (
+        get_cms_setting('CACHE_PREFIX'), site_id, language, show_toolbar,
+        hashlib.md5(request.path.encode('utf-8')).hexdigest())
+
+
+def get_page_response(request, site_id, language):
+    version = get_cache_version()
+    if version is None:
+        return None
+    return cache.get(get_page_cache_key(request, site_id, language), version=version)
+
+
+def set_page_response(request, site_id, language, response):
+    version = get_cache_version()
+    if version is None:
+        return
+    cache.set(get_page_cache_key(request, site_id, language), response,
+              get_cms_setting('CACHE_DURATIONS')['content'], version=version)
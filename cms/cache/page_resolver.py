@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import copy
+import time
+
+from cms.cache import get_cache_generation, bump_cache_generation
+from cms.utils import get_cms_setting
+from django.utils import timezone
+
+# In-process routing indexes, keyed by (site_id, draft)
+_indexes = {}
+# In-process LRU of paths known not to resolve, keyed by (site_id, language)
+_unknown_paths = {}
+
+
+def get_cache_version_key():
+    return "%s:page_resolver:version" % get_cms_setting('CACHE_PREFIX')
+
+
+def get_cache_version():
+    return get_cache_generation(get_cache_version_key(),
+                                get_cms_setting('CACHE_DURATIONS')['menus'])
+
+
+def clear_page_resolver_cache():
+    """
+    Invalidates the routing indexes of all processes. Must be called whenever
+    a page or title change may alter which page a path resolves to.
+    """
+    _indexes.clear()
+    _unknown_paths.clear()
+    bump_cache_generation(get_cache_version_key(),
+                          get_cms_setting('CACHE_DURATIONS')['menus'])
+
+
+class PageRoutingIndex(object):
+    """
+    Maps Title.path to page ids for all pages of one site, either drafts or
+    public pages.
+
+    Paths of all languages are stored in the same mapping, because the
+    resolver matches a path in any language (details() then redirects to the
+    slug of the current language).
+    """
+    def __init__(self, site_id, draft, version):
+        from cms.models import Page, Title
+
+        self.site_id = site_id
+        self.draft = draft
+        self.version = version
+        self.created = time.time()
+        # page id -> (tree_id, published, publication_date, publication_end_date)
+        self.records = {}
+        # root page ids, ordered by tree_id
+        self.roots = []
+        # path -> tuple of page ids
+        self.paths = {}
+        # page id -> pristine Page instance, filled lazily
+        self.pages = {}
+
+        if draft:
+            pages = Page.objects.drafts()
+        else:
+            pages = Page.objects.public()
+        rows = pages.filter(site=site_id).order_by('tree_id').values_list(
+            'pk', 'parent_id', 'tree_id', 'published', 'publication_date', 'publication_end_date')
+        for pk, parent_id, tree_id, published, start, end in rows:
+            self.records[pk] = (tree_id, published, start, end)
+            if parent_id is None:
+                self.roots.append(pk)
+
+        paths = {}
+        titles = Title.objects.filter(page__site=site_id, page__publisher_is_draft=draft)
+        for path, page_id in titles.values_list('path', 'page_id'):
+            paths.setdefault(path, set()).add(page_id)
+        for path, page_ids in paths.items():
+            self.paths[path] = tuple(sorted(page_ids))
+
+    def is_expired(self, version):
+        if version != self.version:
+            return True
+        return time.time() - self.created > get_cms_setting('CACHE_DURATIONS')['menus']
+
+    def _is_published(self, page_id, now):
+        """
+        Python equivalent of PageQuerySet.published()
+        """
+        tree_id, published, start, end = self.records[page_id]
+        if not published:
+            return False
+        if get_cms_setting('SHOW_START_DATE') and start is not None and not start < now:
+            return False
+        if get_cms_setting('SHOW_END_DATE') and end is not None and not end >= now:
+            return False
+        return True
+
+    def resolve(self, path, published_only):
+        """
+        Mirrors get_page_queryset_from_path: returns None if there are no
+        (visible) pages at all, otherwise a list of matching page ids.
+        """
+        now = timezone.now()
+        if published_only:
+            visible = lambda page_id: self._is_published(page_id, now)
+        else:
+            visible = lambda page_id: True
+
+        roots = [page_id for page_id in self.roots if visible(page_id)]
+        if not roots:
+            return None
+        if not path:
+            # the home page is always looked up among published pages
+            for page_id in roots:
+                if self._is_published(page_id, now):
+                    return [page_id]
+        return [page_id for page_id in self.paths.get(path, ()) if visible(page_id)]
+
+    def get_page(self, page_id):
+        """
+        Returns a Page instance the caller may freely modify.
+        """
+        from cms.models import Page
+
+        page = self.pages.get(page_id)
+        if page is None:
+            page = Page.objects.get(pk=page_id)
+            self.pages[page_id] = copy.deepcopy(page)
+            return page
+        return copy.deepcopy(page)
+
+
+def get_routing_index(site_id, draft):
+    """
+    Returns the routing index for the given site, or None if the cache backend
+    can't be used to keep the index in sync between processes.
+    """
+    version = get_cache_version()
+    if version is None:
+        return None
+    key = (site_id, bool(draft))
+    index = _indexes.get(key)
+    if index is None or index.is_expired(version):
+        index = PageRoutingIndex(site_id, bool(draft), version)
+        _indexes[key] = index
+    return index
+
+
+def _get_unknown_paths(site_id, language):
+    version = get_cache_version()
+    if version is None:
+        return None
+    key = (site_id, language)
+    entry = _unknown_paths.get(key)
+    if (entry is None or entry[0] != version or
+            time.time() - entry[1] > get_cms_setting('CACHE_DURATIONS')['menus']):
+        entry = (version, time.time(), OrderedDict())
+        _unknown_paths[key] = entry
+    return entry[2]
+
+
+def is_unknown_path(site_id, language, path):
+    """
+    Returns True if ``path`` is known to resolve neither to a page nor to an
+    apphook.
+    """
+    if not get_cms_setting('UNKNOWN_PATHS_CACHE_SIZE'):
+        return False
+    paths = _get_unknown_paths(site_id, language)
+    if not paths or path not in paths:
+        return False
+    try:
+        # mark as most recently used
+        paths[path] = paths.pop(path)
+    except KeyError:
+        pass
+    return True
+
+
+def set_unknown_path(site_id, language, path):
+    size = get_cms_setting('UNKNOWN_PATHS_CACHE_SIZE')
+    if not size:
+        return
+    paths = _get_unknown_paths(site_id, language)
+    if paths is None:
+        return
+    paths[path] = True
+    while len(paths) > size:
+        try:
+            paths.popitem(last=False)
+        except KeyError:
+            break
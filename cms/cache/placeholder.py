@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from cms.cache import get_cache_generation, bump_cache_generation
+from cms.cache.plugin import get_plugin_cache_vary, get_vary_token, is_cacheable_request
+from cms.utils import get_cms_setting
+from django.core.cache import cache
+
+
+def get_cache_version_key(placeholder_id):
+    return "%s:placeholder_cache:%s:version" % (get_cms_setting('CACHE_PREFIX'), placeholder_id)
+
+
+def get_cache_version(placeholder_id):
+    return get_cache_generation(get_cache_version_key(placeholder_id),
+                                get_cms_setting('CACHE_DURATIONS')['content'])
+
+
+def invalidate_placeholder_cache(placeholder_ids):
+    """
+    Invalidates the cached output of the given placeholders in all languages.
+    """
+    for placeholder_id in set(placeholder_ids):
+        if placeholder_id is not None:
+            bump_cache_generation(get_cache_version_key(placeholder_id),
+                                  get_cms_setting('CACHE_DURATIONS')['content'])
+
+
+def get_plugins_vary(plugins):
+    """
+    Returns the dimensions the output of the given plugins (and of their
+    children) varies on, as a sorted tuple, and how long it may be cached, or
+    None, None if any of them must not be cached.
+    """
+    vary = set()
+    durations = [get_cms_setting('CACHE_DURATIONS')['content']]
+    stack = list(plugins)
+    while stack:
+        plugin = stack.pop()
+        plugin_vary, duration = get_plugin_cache_vary(plugin.plugin_type)
+        if plugin_vary is None:
+            return None, None
+        vary.update(plugin_vary)
+        durations.append(duration)
+        stack.extend(getattr(plugin, 'child_plugin_instances', None) or [])
+    return tuple(sorted(vary)), min(durations)
+
+
+def _get_cache_key(placeholder_id, lang, version):
+    return "%s:placeholder_cache:%s:%s:%s" % (get_cms_setting('CACHE_PREFIX'), placeholder_id, lang, version)
+
+
+def is_placeholder_cacheable(context, placeholder):
+    """
+    Placeholders are cached if CMS_PLACEHOLDER_CACHE is enabled, for GET and
+    HEAD requests outside of edit mode.
+    """
+    if not get_cms_setting('PLACEHOLDER_CACHE') or not placeholder or not placeholder.pk:
+        return False
+    request = context.get('request')
+    if not is_cacheable_request(request):
+        return False
+    toolbar = getattr(request, 'toolbar', None)
+    return not getattr(toolbar, 'edit_mode', False)
+
+
+def get_placeholder_content(context, placeholder, lang):
+    """
+    Returns a dict with the cached ``content`` of the placeholder and the
+    ``sekizai`` data it added to the context, or None.
+
+    The dimensions the output varies on are only known once the plugins of
+    the placeholder have been fetched, so they are cached separately: the
+    first lookup returns them, the second one the output for the values of
+    these dimensions in this request.
+    """
+    version = get_cache_version(placeholder.pk)
+    if version is None:
+        return None
+    key = _get_cache_key(placeholder.pk, lang, version)
+    vary = cache.get(key)
+    if vary is None:
+        return None
+    return cache.get("%s:%s" % (key, get_vary_token(context, vary)))
+
+
+def set_placeholder_content(context, placeholder, lang, vary, duration, content, sekizai):
+    version = get_cache_version(placeholder.pk)
+    if version is None:
+        return
+    key = _get_cache_key(placeholder.pk, lang, version)
+    cache.set(key, vary, duration)
+    cache.set("%s:%s" % (key, get_vary_token(context, vary)),
+              {'content': content, 'sekizai': sekizai}, duration)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import warnings
+
+from cms.cache import get_cache_generations
+from cms.utils import get_cms_setting
+from django.conf import settings
+from django.utils.translation import get_language
+
+# The dimensions the output of a plugin may vary on, see
+# CMSPluginBase.cache_vary
+VARY_DIMENSIONS = ('page', 'path', 'language', 'user', 'groups', 'query')
+
+
+class PluginCacheStats(object):
+    """
+    Counts the hits and misses of the plugin output cache in this process, per
+    plugin type.
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def record(self, plugin_type, hit):
+        counts = self.counts.setdefault(plugin_type, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def get_counts(self, plugin_type=None):
+        """
+        Returns the number of hits and misses of the given plugin type, or of
+        all plugins.
+        """
+        if plugin_type is not None:
+            return tuple(self.counts.get(plugin_type, (0, 0)))
+        return (sum(counts[0] for counts in self.counts.values()),
+                sum(counts[1] for counts in self.counts.values()))
+
+    def get_hit_rate(self, plugin_type=None):
+        """
+        Returns the share of lookups which were hits, or None if there weren't
+        any lookups.
+        """
+        hits, misses = self.get_counts(plugin_type)
+        if not hits + misses:
+            return None
+        return float(hits) / (hits + misses)
+
+    def reset(self):
+        self.counts.clear()
+
+
+plugin_cache_stats = PluginCacheStats()
+
+
+# whether the deprecation of CMS_PLUGIN_CACHE_DATA has been warned about
+LEGACY_CACHE_DATA_WARNED = False
+
+
+def _get_legacy_cache_vary(plugin_type):
+    # CMS_PLUGIN_CACHE_DATA used to be the only way to cache plugins, always
+    # keyed by path, language and user, and never for requests with
+    # parameters. Anonymous visitors were told apart by their CSRF token, so
+    # forms containing it weren't shared.
+    global LEGACY_CACHE_DATA_WARNED
+    plugin_cache_data = getattr(settings, 'CMS_PLUGIN_CACHE_DATA', None)
+    if not plugin_cache_data:
+        return None, None
+    if not LEGACY_CACHE_DATA_WARNED:
+        warnings.warn("CMS_PLUGIN_CACHE_DATA is deprecated, declare cache_vary on "
+                      "the plugin classes instead", DeprecationWarning)
+        LEGACY_CACHE_DATA_WARNED = True
+    cache_data = dict(cacheable=False, vary_user=True,
+                      duration=getattr(settings, 'CMS_CACHE_DURATION', None))
+    cache_data.update(plugin_cache_data.get('default', {}))
+    cache_data.update(plugin_cache_data.get(plugin_type, {}))
+    if not cache_data['cacheable']:
+        return None, None
+    if cache_data['vary_user']:
+        return ('csrf', 'language', 'path', 'query', 'user'), cache_data['duration']
+    return ('language', 'path', 'query'), cache_data['duration']
+
+
+def get_plugin_cache_vary(plugin_type):
+    """
+    Returns the dimensions the output of plugins of the given type varies on
+    (None if it must not be cached) and how long it may be cached.
+    """
+    from cms.plugin_pool import plugin_pool
+
+    plugin_class = plugin_pool.get_plugin(plugin_type)
+    vary, duration = plugin_class.cache_vary, plugin_class.cache_duration
+    if vary is None:
+        vary, duration = _get_legacy_cache_vary(plugin_type)
+        if vary is None:
+            return None, None
+    if not duration:
+        duration = get_cms_setting('CACHE_DURATIONS')['content']
+    return tuple(sorted(vary)), duration
+
+
+def is_cacheable_request(request):
+    return request is not None and request.method in ('GET', 'HEAD')
+
+
+def _get_user_group_ids(request, user):
+    group_ids = getattr(request, '_cms_user_group_ids', None)
+    if group_ids is None:
+        if user.is_authenticated():
+            group_ids = tuple(sorted(user.groups.values_list('pk', flat=True)))
+        else:
+            group_ids = ()
+        request._cms_user_group_ids = group_ids
+    return group_ids
+
+
+def get_vary_token(context, vary):
+    """
+    Returns a hash of the values of the given dimensions in the current
+    request.
+    """
+    request = context['request']
+    user = context.get('user', getattr(request, 'user', None))
+    values = []
+    for dimension in vary:
+        if dimension == 'page':
+            page = getattr(request, 'current_page', None)
+            values.append(getattr(page, 'pk', None))
+        elif dimension == 'path':
+            values.append(request.path)
+        elif dimension == 'language':
+            values.append(context.get('lang') or get_language())
+        elif dimension == 'user':
+            values.append(user.pk if user is not None and user.is_authenticated() else None)
+        elif dimension == 'groups':
+            values.append(_get_user_group_ids(request, user) if user is not None else ())
+        elif dimension == 'query':
+            values.append(sorted(request.GET.lists()))
+        elif dimension == 'csrf':
+            # only used for CMS_PLUGIN_CACHE_DATA
+            if user is not None and user.is_authenticated():
+                values.append(None)
+            else:
+                values.append(unicode(context.get('csrf_token', '')))
+    return hashlib.md5(repr(values)).hexdigest()
+
+
+def get_plugin_cache_key(plugin, context, vary, version):
+    """
+    Returns the key the output of the plugin is cached under. ``version`` is
+    the generation of the plugin's placeholder, which changes whenever one of
+    its plugins changes (plugins render their children).
+    """
+    return "%s:plugin_cache:%s:%s:%s" % (get_cms_setting('CACHE_PREFIX'), plugin.pk, version,
+                                         get_vary_token(context, vary))
+
+
+def get_plugin_cache_keys(plugins, context, processors=None):
+    """
+    Returns a dict mapping the ids of those plugins whose output may be
+    cached in this request to their cache key and duration. The generations
+    of their placeholders are fetched in one go.
+    """
+    if processors or not is_cacheable_request(context.get('request') if context else None):
+        return {}
+    from cms.cache.placeholder import get_cache_version_key
+
+    varies = {}
+    for plugin in plugins:
+        vary, duration = get_plugin_cache_vary(plugin.plugin_type)
+        if vary is not None:
+            varies[plugin.pk] = (plugin, vary, duration)
+    if not varies:
+        return {}
+    placeholder_ids = sorted(set(plugin.placeholder_id for plugin, vary, duration in varies.values()))
+    versions = get_cache_generations([get_cache_version_key(placeholder_id) for placeholder_id in placeholder_ids],
+                                     get_cms_setting('CACHE_DURATIONS')['content'])
+    if versions is None:
+        return {}
+    versions = dict(zip(placeholder_ids, versions))
+    keys = {}
+    for pk, (plugin, vary, duration) in varies.items():
+        keys[pk] = (get_plugin_cache_key(plugin, context, vary, versions[plugin.placeholder_id]), duration)
+    return keys
@@ -7,6 +7,7 @@ from cms.management.commands.subcommands.moderator import ModeratorCommand
 from cms.management.commands.subcommands.uninstall import UninstallCommand
 from cms.management.commands.subcommands.mptt import FixMPTTCommand
 from cms.management.commands.subcommands.delete_orphaned_plugins import DeleteOrphanedPluginsCommand
+from cms.management.commands.subcommands.warm_menus import WarmMenusCommand
 from django.core.management.base import BaseCommand
 from optparse import make_option
 
@@ -29,6 +30,7 @@ class Command(SubcommandsCommand):
         'fix-mptt': FixMPTTCommand,
         'delete_orphaned_plugins': DeleteOrphanedPluginsCommand,
         'check': CheckInstallation,
+        'warm_menus': WarmMenusCommand,
     }
 
     @property
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from menus.menu_pool import menu_pool
+
+
+class WarmMenusCommand(BaseCommand):
+    help = 'Build and cache the menus of the current site for anonymous visitors'
+    args = '[<language> [<language 2> [...]]]'
+
+    def handle(self, *languages, **options):
+        """
+        Builds the menus in the given languages, or in all languages of the
+        site.
+        """
+        languages = menu_pool.warm(languages)
+        self.stdout.write("warmed menus for languages: %s\n" % ", ".join(languages))
@@ -3,6 +3,7 @@ from collections import defaultdict
 from cms.apphook_pool import apphook_pool
 from cms.models.permissionmodels import (ACCESS_DESCENDANTS,
     ACCESS_PAGE_AND_DESCENDANTS, ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE)
+from cms.models.pagemodel import Page
 from cms.models.permissionmodels import PagePermission, GlobalPagePermission
 from cms.models.titlemodels import Title
 from cms.utils import get_language_from_request
@@ -12,13 +13,72 @@ from cms.utils.page_resolver import get_page_queryset
 from cms.utils.moderator import get_title_queryset
 from cms.utils.plugins import current_site
 from menus.base import Menu, NavigationNode, Modifier
-from menus.menu_pool import menu_pool
+from menus.menu_pool import get_namespace_index, menu_pool
 
 from django.contrib.sites.models import Site
 from django.db.models.query_utils import Q
 from django.utils.translation import get_language
 
 
+def get_restricted_pages(site=None):
+    """
+    Returns a dict mapping the ids of all pages with view restrictions (both
+    the draft and the public id) to the (user_id, group_id) of the grants
+    applying to them.
+
+    The pages covered by the grants on children or descendants are found by
+    sweeping each affected tree in mptt order, keeping a stack of the grant
+    intervals around the current page.
+    """
+    restricted_pages = defaultdict(list)
+    page_permissions = PagePermission.objects.filter(can_view=True)
+    if site:
+        page_permissions = page_permissions.filter(page__site=site.pk)
+    # tree_id -> [(lft, rght, level, grant_on, user_id, group_id)]
+    grants = defaultdict(list)
+    for (user_id, group_id, grant_on, page_id, public_id,
+         tree_id, lft, rght, level) in page_permissions.values_list(
+            'user_id', 'group_id', 'grant_on', 'page_id', 'page__publisher_public_id',
+            'page__tree_id', 'page__lft', 'page__rght', 'page__level'):
+        # the page of a grant counts as restricted even if the grant is only
+        # on its children
+        page_grants = restricted_pages[page_id]
+        if grant_on in [ACCESS_PAGE, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE_AND_DESCENDANTS]:
+            page_grants.append((user_id, group_id))
+            restricted_pages[public_id].append((user_id, group_id))
+        if grant_on != ACCESS_PAGE and rght - lft > 1:
+            grants[tree_id].append((lft, rght, level, grant_on, user_id, group_id))
+    if not grants:
+        return restricted_pages
+
+    pages = Page.objects.filter(tree_id__in=grants.keys()).order_by('tree_id', 'lft')
+    tree_grants = []
+    stack = []
+    current_tree_id = None
+    for id, public_id, tree_id, lft, rght, level in pages.values_list(
+            'id', 'publisher_public_id', 'tree_id', 'lft', 'rght', 'level'):
+        if tree_id != current_tree_id:
+            current_tree_id = tree_id
+            tree_grants = sorted(grants[tree_id], reverse=True)
+            stack = []
+        # keep the grants on this page and its ancestors
+        while stack and stack[-1][1] < lft:
+            stack.pop()
+        while tree_grants and tree_grants[-1][0] <= lft:
+            stack.append(tree_grants.pop())
+        for grant_lft, grant_rght, grant_level, grant_on, user_id, group_id in stack:
+            if grant_lft == lft:
+                continue
+            if grant_on in [ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN]:
+                if level != grant_level + 1:
+                    continue
+            elif grant_on not in [ACCESS_DESCENDANTS, ACCESS_PAGE_AND_DESCENDANTS]:
+                continue
+            restricted_pages[id].append((user_id, group_id))
+            restricted_pages[public_id].append((user_id, group_id))
+    return restricted_pages
+
+
 def get_visible_pages(request, pages, site=None):
     """
      This code is basically a many-pages-at-once version of
@@ -32,34 +92,7 @@ def get_visible_pages(request, pages, site=None):
     is_setting_public_staff = public_for == 'staff'
     is_auth_user = request.user.is_authenticated()
     visible_page_ids = []
-    restricted_pages = defaultdict(list)
-    page_permissions = PagePermission.objects.filter(can_view=True).select_related('page', 'group__users')
-
-    for perm in page_permissions:
-
-        # collect the pages that are affected by permissions
-        if site and perm.page.site_id != site.pk:
-            continue
-        if perm is not None and perm not in restricted_pages[perm.page.pk]:
-            # affective restricted pages gathering
-            # using mptt functions 
-            # add the page with the perm itself
-            if perm.grant_on in [ACCESS_PAGE, ACCESS_PAGE_AND_CHILDREN, ACCESS_PAGE_AND_DESCENDANTS]:
-                restricted_pages[perm.page.pk].append(perm)
-                restricted_pages[perm.page.publisher_public_id].append(perm)
-                # add children
-            if perm.grant_on in [ACCESS_CHILDREN, ACCESS_PAGE_AND_CHILDREN]:
-                child_ids = perm.page.get_children().values_list('id', 'publisher_public_id')
-                for id, public_id in child_ids:
-                    restricted_pages[id].append(perm)
-                    restricted_pages[public_id].append(perm)
-            # add descendants
-            elif perm.grant_on in [ACCESS_DESCENDANTS, ACCESS_PAGE_AND_DESCENDANTS]:
-                child_ids = perm.page.get_descendants().values_list('id', 'publisher_public_id')
-                for id, public_id in child_ids:
-                    restricted_pages[id].append(perm)
-                    restricted_pages[public_id].append(perm)
-
+    restricted_pages = get_restricted_pages(site)
     # anonymous
     # no restriction applied at all
     if (not is_auth_user and
@@ -98,22 +131,24 @@ def get_visible_pages(request, pages, site=None):
 
     has_global_perm.cache = -1
 
+    def get_group_ids():
+        if get_group_ids.cache is None:
+            get_group_ids.cache = set(request.user.groups.values_list('pk', flat=True))
+        return get_group_ids.cache
+
+    get_group_ids.cache = None
+
     def has_permission_membership(page):
         """
         PagePermission user group membership tests
         """
         user_pk = request.user.pk
-        page_pk = page.pk
-        has_perm = False
-        for perm in restricted_pages[page_pk]:
-            if perm.user_id == user_pk:
-                has_perm = True
-            if not perm.group_id:
-                continue
-            group_user_ids = perm.group.user_set.values_list('pk', flat=True)
-            if user_pk in group_user_ids:
-                has_perm = True
-        return has_perm
+        for user_id, group_id in restricted_pages[page.pk]:
+            if user_id == user_pk:
+                return True
+            if group_id and group_id in get_group_ids():
+                return True
+        return False
 
     for page in pages:
         to_add = False
@@ -222,6 +257,8 @@ def page_to_node(page, home, cut):
 
 
 class CMSMenu(Menu):
+    shared_by_visibility = True
+
     def get_nodes(self, request):
         page_queryset = get_page_queryset(request)
         site = Site.objects.get_current()
@@ -286,6 +323,12 @@ class NavExtender(Modifier):
     def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
         if post_cut:
             return nodes
+        # the index of the cached tree, unless the nodes changed since
+        namespace_index = None
+        if hasattr(nodes, 'get_namespace_index'):
+            namespace_index = nodes.get_namespace_index()
+        if namespace_index is None:
+            namespace_index = get_namespace_index(nodes)
         exts = []
         # rearrange the parent relations
         home = None
@@ -297,8 +340,9 @@ class NavExtender(Modifier):
                 for ext in extenders:
                     if not ext in exts:
                         exts.append(ext)
-                    for extnode in nodes:
-                        if extnode.namespace == ext and not extnode.parent_id:# if home has nav extenders but home is not visible
+                    for position in namespace_index.get(ext, ((), ()))[0]:
+                        extnode = nodes[position]
+                        if not extnode.parent_id:# if home has nav extenders but home is not visible
                             if node.attr.get("is_home", False) and not node.visible:
                                 extnode.parent_id = None
                                 extnode.parent_namespace = None
@@ -308,13 +352,11 @@ class NavExtender(Modifier):
                                 extnode.parent_namespace = node.namespace
                                 extnode.parent = node
                                 node.children.append(extnode)
-        removed = []
+        removed = set()
         # find all not assigned nodes
         for menu in menu_pool.menus.items():
             if hasattr(menu[1], 'cms_enabled') and menu[1].cms_enabled and not menu[0] in exts:
-                for node in nodes:
-                    if node.namespace == menu[0]:
-                        removed.append(node)
+                removed.update(namespace_index.get(menu[0], ((), ()))[1])
         if breadcrumb:
         # if breadcrumb and home not in navigation add node
             if breadcrumb and home and not home.visible:
@@ -324,8 +366,8 @@ class NavExtender(Modifier):
                 else:
                     home.selected = False
                     # remove all nodes that are nav_extenders and not assigned
-        for node in removed:
-            nodes.remove(node)
+        if removed:
+            nodes = [node for position, node in enumerate(nodes) if position not in removed]
         return nodes
 
 
@@ -406,6 +448,8 @@ class SoftRootCutter(Modifier):
             return nodes
         selected = None
         root_nodes = []
+        # nodes cut off below soft roots
+        self.removed = set()
         # find the selected node as well as all the root nodes
         for node in nodes:
             if node.selected:
@@ -426,6 +470,8 @@ class SoftRootCutter(Modifier):
             else:
                 # if it's not a soft root, walk ancestors (upwards!)
                 nodes = self.find_ancestors_and_remove_children(selected, nodes)
+        if self.removed:
+            nodes = [node for node in nodes if id(node) not in self.removed]
         return nodes
 
     def find_and_remove_children(self, node, nodes):
@@ -436,7 +482,7 @@ class SoftRootCutter(Modifier):
 
     def remove_children(self, node, nodes):
         for child in node.children:
-            nodes.remove(child)
+            self.removed.add(id(child))
             self.remove_children(child, nodes)
         node.children = []
 
@@ -5,13 +5,19 @@ from cms.apphook_pool import apphook_pool
 
 class LazyPage(object):
     def __get__(self, request, obj_type=None):
-        from cms.utils.page_resolver import get_page_from_request
+        from cms.utils.page_resolver import (get_page_from_request,
+            is_unknown_request_path, set_unknown_request_path)
         if not hasattr(request, '_current_page_cache'):
+            if is_unknown_request_path(request):
+                request._current_page_cache = None
+                return None
             request._current_page_cache = get_page_from_request(request)
             if not request._current_page_cache:
                 # if this is in a apphook
                 # find the page the apphook is attached to
                 request._current_page_cache = applications_page_check(request)
+                if not request._current_page_cache:
+                    set_unknown_request_path(request)
         return request._current_page_cache
 
 class LazyPageApp(object):
@@ -3,7 +3,6 @@ import os
 import warnings
 from datetime import date
 
-from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.db import models
@@ -12,6 +11,7 @@ from django.db.models.query_utils import DeferredAttribute
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from cms.cache.plugin import get_plugin_cache_keys, plugin_cache_stats
 from cms.exceptions import DontUsePageAttributeWarning
 from cms.models.placeholdermodel import Placeholder
 from cms.plugin_rendering import PluginContext, render_plugin
@@ -163,48 +163,6 @@ class CMSPlugin(MPTTModel):
             instance = self
         return instance, plugin
 
-    def _plugin_cache_data(self, plugintype):
-        # defaults imply no caching
-        cache_info = dict(
-            cacheable=False,
-            vary_user=True,
-            duration=getattr(settings, 'CMS_CACHE_DURATION', 0))
-
-        if hasattr(settings, 'CMS_PLUGIN_CACHE_DATA'):
-            pcd = settings.CMS_PLUGIN_CACHE_DATA
-            cache_info.update(pcd['default'])
-            if self.plugin_type in pcd:
-                cache_info.update(pcd[self.plugin_type])
-        return cache_info
-
-    def _user_cache_token(self, context, cache_data):
-        if not cache_data['vary_user']:
-            return ''
-
-        user = context.get('user')
-        user_uniqueness = None
-        if user.is_anonymous:
-            csrf_token = context.get('csrf_token')
-            if csrf_token:
-                user_uniqueness = csrf_token
-        else:
-            user_uniqueness = user.username
-        return user_uniqueness
-
-    def _plugin_cache_key(self, context, placeholder, cache_data):
-        if not cache_data['cacheable']:
-            return None
-
-        user_uniqueness = self._user_cache_token(context, cache_data)
-        ckey = "CMSPlugin_id_%d_placeh_%s_path_%s_lang_%s_user_%s" % (
-            self.id,
-            placeholder,
-            context.get('request').path,
-            context.get('lang'),
-            user_uniqueness
-            )
-        return ckey
-
     def _render_plugin(self, context=None, placeholder=None, admin=False, processors=None):
         instance, plugin = self.get_plugin_instance()
         if instance and not (admin and not plugin.admin_preview):
@@ -229,25 +187,21 @@ class CMSPlugin(MPTTModel):
         return ""
 
     def render_plugin(self, context=None, placeholder=None, admin=False, processors=None):
-        cache_duration = None
-        cacheable = False
-
-        if len(context.get('request').REQUEST.keys()) == 0:
-            # only consider caching if there are no parameters
-            cache_data = self._plugin_cache_data(self.plugin_type)
-            if cache_data['cacheable']:
-                cacheable = True
-                ckey = self._plugin_cache_key(context, placeholder, cache_data)
-                cache_duration = cache_data['duration']
-
-        text = cache.get(ckey) if cacheable else None
-
+        """
+        Renders the plugin, using the cached output if its plugin class
+        declares what the output varies on (CMSPluginBase.cache_vary).
+        """
+        ckey = None
+        if not admin:
+            ckey, duration = get_plugin_cache_keys([self], context, processors).get(self.pk, (None, None))
+
+        if ckey is None:
+            return self._render_plugin(context, placeholder, admin, processors)
+        text = cache.get(ckey)
+        plugin_cache_stats.record(self.plugin_type, text is not None)
         if text is None:
             text = self._render_plugin(context, placeholder, admin, processors)
-            if cacheable:
-                cache.set(ckey, text, cache_duration)
-        else:
-            pass
+            cache.set(ckey, text, duration)
         return text
 
     def get_media_path(self, filename):
@@ -2,6 +2,7 @@
 from distutils.version import LooseVersion
 import re
 
+from cms.cache.plugin import VARY_DIMENSIONS
 from cms.utils import get_cms_setting
 from cms.exceptions import SubClassNeededError, Deprecated
 from cms.models import CMSPlugin
@@ -76,6 +77,14 @@ class CMSPluginBaseMetaclass(forms.MediaDefiningClass):
                         }
                     )
                 ]
+        # validate the cache declaration
+        if new_plugin.cache_vary is not None:
+            unknown = set(new_plugin.cache_vary) - set(VARY_DIMENSIONS)
+            if isinstance(new_plugin.cache_vary, basestring) or unknown:
+                raise ImproperlyConfigured(
+                    "The 'cache_vary' attribute of %r must be None or a tuple "
+                    "of %s." % (new_plugin, ", ".join(VARY_DIMENSIONS))
+                )
         # Set default name
         if not new_plugin.name:
             new_plugin.name = re.sub("([a-z])([A-Z])", "\g<1> \g<2>", name)
@@ -105,6 +114,14 @@ class CMSPluginBase(admin.ModelAdmin):
     allow_children = False
     child_classes = None
 
+    # What the output of the plugin varies on: a tuple of 'page', 'path',
+    # 'language', 'user', 'groups' (the user's groups) and 'query' (the query
+    # string). None disables caching, an empty tuple shares the output
+    # between all requests.
+    cache_vary = None
+    # Seconds the output is cached, CMS_CACHE_DURATIONS['content'] by default
+    cache_duration = None
+
     opts = {}
     module = None #track in which module/application belongs
 
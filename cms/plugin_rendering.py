@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+from cms.cache.placeholder import (get_placeholder_content, get_plugins_vary,
+    is_placeholder_cacheable, set_placeholder_content)
+from cms.cache.plugin import get_plugin_cache_keys, plugin_cache_stats
 from cms.models.placeholdermodel import Placeholder
 from cms.plugin_processors import (plugin_meta_context_processor,
     mark_safe_plugin_processor)
@@ -7,10 +10,13 @@ from cms.utils.conf import get_cms_setting
 from cms.utils.django_load import iterload_objects
 from cms.utils.placeholder import get_placeholder_conf
 from django.conf import settings
+from django.core.cache import cache
 from django.template import Template, Context
 from django.template.defaultfilters import title
 from django.template.loader import render_to_string
+from django.test.signals import setting_changed
 from django.utils.translation import ugettext_lazy as _
+from sekizai.helpers import Watcher, get_varname
 
 # these are always called before all other plugin context processors
 DEFAULT_PLUGIN_CONTEXT_PROCESSORS = (
@@ -22,6 +28,65 @@ DEFAULT_PLUGIN_PROCESSORS = (
     mark_safe_plugin_processor,
 )
 
+# the processors loaded from CMS_PLUGIN_CONTEXT_PROCESSORS and
+# CMS_PLUGIN_PROCESSORS, see clear_processor_chains
+_processor_chains = {}
+
+
+class PluginProcessorChain(object):
+    """
+    Applies the plugin processors configured in CMS_PLUGIN_PROCESSORS, then the
+    processors passed for this render, then DEFAULT_PLUGIN_PROCESSORS to the
+    rendered content of a plugin.
+    """
+    def __init__(self, processors):
+        self.processors = tuple(processors)
+
+    def __call__(self, instance, placeholder, content, context, processors=None):
+        for processor in self.processors:
+            content = processor(instance, placeholder, content, context)
+        for processor in processors or ():
+            content = processor(instance, placeholder, content, context)
+        for processor in DEFAULT_PLUGIN_PROCESSORS:
+            content = processor(instance, placeholder, content, context)
+        return content
+
+
+def get_plugin_context_processors():
+    """
+    Returns the plugin context processors to call, the defaults followed by
+    those of CMS_PLUGIN_CONTEXT_PROCESSORS, which are only imported once.
+    """
+    processors = _processor_chains.get('context_processors')
+    if processors is None:
+        processors = DEFAULT_PLUGIN_CONTEXT_PROCESSORS + tuple(
+            iterload_objects(get_cms_setting('PLUGIN_CONTEXT_PROCESSORS')))
+        _processor_chains['context_processors'] = processors
+    return processors
+
+
+def get_plugin_processor_chain():
+    """
+    Returns the PluginProcessorChain for CMS_PLUGIN_PROCESSORS, whose
+    processors are only imported once.
+    """
+    chain = _processor_chains.get('processors')
+    if chain is None:
+        chain = PluginProcessorChain(iterload_objects(get_cms_setting('PLUGIN_PROCESSORS')))
+        _processor_chains['processors'] = chain
+    return chain
+
+
+def clear_processor_chains(setting=None, **kwargs):
+    """
+    Forgets the compiled processor chains, so they are loaded from the
+    settings again. Connected to the setting_changed signal.
+    """
+    if setting is None or setting in ('CMS_PLUGIN_PROCESSORS', 'CMS_PLUGIN_CONTEXT_PROCESSORS'):
+        _processor_chains.clear()
+
+setting_changed.connect(clear_processor_chains, dispatch_uid="cms.plugin_rendering.processor_chains")
+
 
 class PluginContext(Context):
     """
@@ -32,13 +97,9 @@ class PluginContext(Context):
     """
     def __init__(self, dict, instance, placeholder, processors=None, current_app=None):
         super(PluginContext, self).__init__(dict, current_app=current_app)
-        if not processors:
-            processors = []
-        for processor in DEFAULT_PLUGIN_CONTEXT_PROCESSORS:
-            self.update(processor(instance, placeholder))
-        for processor in iterload_objects(get_cms_setting('PLUGIN_CONTEXT_PROCESSORS')):
+        for processor in get_plugin_context_processors():
             self.update(processor(instance, placeholder))
-        for processor in processors:
+        for processor in processors or ():
             self.update(processor(instance, placeholder))
 
 def render_plugin(context, instance, placeholder, template, processors=None,
@@ -47,21 +108,13 @@ def render_plugin(context, instance, placeholder, template, processors=None,
     Renders a single plugin and applies the post processors to it's rendered
     content.
     """
-    if not processors:
-        processors = []
     if isinstance(template, basestring):
         content = render_to_string(template, context_instance=context)
     elif isinstance(template, Template):
         content = template.render(context)
     else:
         content = ''
-    for processor in iterload_objects(get_cms_setting('PLUGIN_PROCESSORS')):
-        content = processor(instance, placeholder, content, context)
-    for processor in processors:
-        content = processor(instance, placeholder, content, context)
-    for processor in DEFAULT_PLUGIN_PROCESSORS:
-        content = processor(instance, placeholder, content, context)
-    return content
+    return get_plugin_processor_chain()(instance, placeholder, content, context, processors)
 
 def render_plugins(plugins, context, placeholder, processors=None):
     """
@@ -71,26 +124,86 @@ def render_plugins(plugins, context, placeholder, processors=None):
     
     This is the main plugin rendering utility function, use this function rather than
     Plugin.render_plugin().
+
+    The cached output of all cacheable plugins is fetched with a single
+    cache.get_many, misses are written back with cache.set_many.
     """
+    from cms.models.pluginmodel import CMSPlugin
+
+    # plugins overriding render_plugin are left to it
+    batched = [plugin for plugin in plugins
+               if getattr(plugin.render_plugin, '__func__', None) is CMSPlugin.render_plugin.__func__]
+    cache_keys = get_plugin_cache_keys(batched, context, processors)
+    cached = cache.get_many([key for key, duration in cache_keys.values()]) if cache_keys else {}
+    missed = {}
     out = []
     total = len(plugins)
     for index, plugin in enumerate(plugins):
         plugin._render_meta.total = total
         plugin._render_meta.index = index
         context.push()
-        out.append(plugin.render_plugin(context, placeholder, processors=processors))
+        key, duration = cache_keys.get(plugin.pk, (None, None))
+        if key is None:
+            content = plugin.render_plugin(context, placeholder, processors=processors)
+        else:
+            content = cached.get(key)
+            plugin_cache_stats.record(plugin.plugin_type, content is not None)
+            if content is None:
+                content = plugin._render_plugin(context, placeholder, processors=processors)
+                missed.setdefault(duration, {})[key] = content
+        out.append(content)
         context.pop()
+    for duration, contents in missed.items():
+        cache.set_many(contents, duration)
     return out
 
+def restore_sekizai(context, changes):
+    """
+    Adds the sekizai data recorded by a sekizai.helpers.Watcher while
+    rendering cached content to the context.
+    """
+    sekizai_container = context.get(get_varname())
+    if sekizai_container is None:
+        return
+    for key, values in changes.items():
+        sekizai_namespace = sekizai_container[key]
+        for value in values:
+            sekizai_namespace.append(value)
+
+def render_cached_placeholder(placeholder, context, lang=None):
+    """
+    Returns the cached output of the placeholder and adds the sekizai data
+    added while rendering it to the context, or returns None if the
+    placeholder isn't cached.
+    """
+    if not is_placeholder_cacheable(context, placeholder):
+        return None
+    lang = lang or get_language_from_request(context['request'])
+    cached = get_placeholder_content(context, placeholder, lang)
+    if cached is None:
+        return None
+    restore_sekizai(context, cached['sekizai'])
+    return cached['content']
+
 def render_placeholder(placeholder, context_to_copy, name_fallback="Placeholder", lang=None):
     """
     Renders plugins for a placeholder on the given page using shallow copies of the 
     given context, and returns a string containing the rendered output.
+
+    With CMS_PLACEHOLDER_CACHE enabled, the output is cached along with the
+    sekizai data added while rendering it.
     """
     from cms.plugins.utils import get_plugins
     context = context_to_copy
-    context.push()
     request = context['request']
+    cacheable = is_placeholder_cacheable(context, placeholder)
+    if cacheable:
+        cache_lang = lang or get_language_from_request(request)
+        content = render_cached_placeholder(placeholder, context, cache_lang)
+        if content is not None:
+            return content
+        watcher = Watcher(context)
+    context.push()
     plugins = [plugin for plugin in get_plugins(request, placeholder, lang=lang)]
     page = placeholder.page if placeholder else None
     if page:
@@ -129,6 +242,11 @@ def render_placeholder(placeholder, context_to_copy, name_fallback="Placeholder"
     if edit:
         content = render_placeholder_toolbar(placeholder, context, content, name_fallback)
     context.pop()
+    if cacheable:
+        vary, duration = get_plugins_vary(plugins)
+        if vary is not None:
+            set_placeholder_content(context, placeholder, cache_lang, vary, duration, content,
+                                    watcher.get_changes())
     return content
 
 def render_placeholder_toolbar(placeholder, context, content, name_fallback=None):
@@ -1,7 +1,8 @@
-from collections import defaultdict
 import operator
 from itertools import groupby
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.query import QuerySet
 from django.utils.translation import ugettext as _
 
 from cms.exceptions import PluginLimitReached
@@ -25,7 +26,7 @@ def assign_plugins(request, placeholders, lang=None):
     """
     Fetch all plugins for the given ``placeholders`` and
     cast them down to the concrete instances in one query
-    per type.
+    (see downcast_plugins).
     """
     placeholders = list(placeholders)
     if not placeholders:
@@ -85,26 +86,106 @@ def build_plugin_tree(plugin_list):
     return root
 
 
+def _get_plugin_relations(plugin_classes):
+    """
+    Returns a dict mapping the names of the given plugin classes to the name
+    of the reverse one-to-one relation from CMSPlugin to their model, or to
+    None for plugins using CMSPlugin itself.
+
+    Models inheriting from another plugin model are mapped to the path of
+    relations through it (like ``text__subtext``), which select_related can't
+    follow, so downcast_plugins fetches them separately.
+    """
+    from cms.models import CMSPlugin
+
+    relations = {}
+    for plugin_class in plugin_classes:
+        model = plugin_class.model._meta.concrete_model
+        path = []
+        while model is not CMSPlugin:
+            for parent, ptr in model._meta.parents.items():
+                if issubclass(parent, CMSPlugin):
+                    break
+            # ptr.related may describe an abstract base of the model
+            path.insert(0, ptr.rel.related_name or model._meta.object_name.lower())
+            model = parent
+        relations[plugin_class.__name__] = '__'.join(path) or None
+    return relations
+
+
+def _get_selected_relations(relations, select_placeholder):
+    select = set(relation for relation in relations.values() if relation and '__' not in relation)
+    if select_placeholder:
+        select.add('placeholder')
+    return sorted(select)
+
+
+def _as_model(instance, model):
+    # proxy plugin models get instances of their own class
+    if instance.__class__ is model:
+        return instance
+    proxy = model(*[getattr(instance, field.attname) for field in model._meta.fields])
+    proxy._state.db = instance._state.db
+    proxy._state.adding = False
+    return proxy
+
+
 def downcast_plugins(queryset, select_placeholder=False):
-    plugin_types_map = defaultdict(list)
-    plugin_lookup = {}
-
-    # make a map of plugin types, needed later for downcasting
-    for plugin in queryset:
-        plugin_types_map[plugin.plugin_type].append(plugin.pk)
-    for plugin_type, pks in plugin_types_map.iteritems():
-        cls = plugin_pool.get_plugin(plugin_type)
-        # get all the plugins of type cls.model
-        plugin_qs = cls.model.objects.filter(pk__in=pks)
-        if select_placeholder:
-            plugin_qs = plugin_qs.select_related('placeholder')
-
-        # put them in a map so we can replace the base CMSPlugins with their
-        # downcasted versions
-        for instance in plugin_qs:
-            plugin_lookup[instance.pk] = instance
-            # make the equivalent list of qs, but with downcasted instances
-    plugin_list = [plugin_lookup[p.pk] for p in queryset if p.pk in plugin_lookup]
+    """
+    Returns the plugins of the queryset as instances of their plugin models.
+
+    If the queryset hasn't been evaluated yet, the rows of all plugin models
+    are fetched along with the base CMSPlugin rows, in a single query.
+    Otherwise they are fetched in one additional query, for the plugin types
+    in the queryset only. Either way the base fields are only loaded once.
+    Plugin models inheriting from another plugin model cost one more query
+    per type.
+    """
+    from cms.models import CMSPlugin
+
+    if isinstance(queryset, QuerySet) and queryset._result_cache is None:
+        relations = _get_plugin_relations(plugin_pool.get_all_plugins())
+        plugins = list(queryset.select_related(*_get_selected_relations(relations, select_placeholder)))
+    else:
+        base_plugins = list(queryset)
+        plugin_types = set(plugin.plugin_type for plugin in base_plugins)
+        relations = _get_plugin_relations(plugin_pool.get_plugin(plugin_type) for plugin_type in plugin_types)
+        plugins = []
+        if base_plugins:
+            rows = CMSPlugin.objects.filter(pk__in=[plugin.pk for plugin in base_plugins])
+            rows = rows.select_related(*_get_selected_relations(relations, select_placeholder))
+            rows = rows.in_bulk([plugin.pk for plugin in base_plugins])
+            plugins = [rows[plugin.pk] for plugin in base_plugins if plugin.pk in rows]
+    # plugin models inheriting from another plugin model
+    nested = {}
+    for plugin in plugins:
+        plugin_class = plugin_pool.get_plugin(plugin.plugin_type)
+        relation = relations.get(plugin_class.__name__)
+        if relation and '__' in relation:
+            nested.setdefault(plugin_class.model, []).append(plugin.pk)
+    nested_instances = {}
+    for model, pks in nested.items():
+        nested_instances.update(model.objects.in_bulk(pks))
+    placeholder_cache_name = CMSPlugin._meta.get_field('placeholder').get_cache_name()
+    plugin_list = []
+    for plugin in plugins:
+        plugin_class = plugin_pool.get_plugin(plugin.plugin_type)
+        relation = relations.get(plugin_class.__name__)
+        if relation is None:
+            instance = plugin
+        elif '__' in relation:
+            instance = nested_instances.get(plugin.pk)
+            if instance is None:
+                continue
+        else:
+            try:
+                instance = getattr(plugin, relation)
+            except ObjectDoesNotExist:
+                continue
+        instance = _as_model(instance, plugin_class.model)
+        if select_placeholder and hasattr(plugin, placeholder_cache_name):
+            setattr(instance, placeholder_cache_name, getattr(plugin, placeholder_cache_name))
+        plugin_list.append(instance)
     return plugin_list
 
 
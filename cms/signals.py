@@ -4,8 +4,13 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import signals
 from django.dispatch import Signal
 
+from cms.appresolver import clear_app_url_resolvers
+from cms.cache.page import invalidate_page_cache
+from cms.cache.page_resolver import clear_page_resolver_cache
+from cms.cache.placeholder import invalidate_placeholder_cache
 from cms.cache.permissions import clear_user_permission_cache, clear_permission_cache
-from cms.models import Page, Title, CMSPlugin, PagePermission, GlobalPagePermission, PageUser, PageUserGroup
+from cms.models import (Page, Title, CMSPlugin, Placeholder, PagePermission, GlobalPagePermission, PageUser,
+    PageUserGroup)
 
 from menus.menu_pool import menu_pool
 
@@ -19,6 +24,9 @@ application_post_changed = Signal(providing_args=["instance"])
 # than one instances published before this signal gets called
 post_publish = Signal(providing_args=["instance"])
 
+# compiled apphook urlconfs depend on the applications hooked to titles
+application_post_changed.connect(clear_app_url_resolvers, dispatch_uid="cms.appresolver.clear_url_resolvers")
+
 
 def update_plugin_positions(**kwargs):
     plugin = kwargs['instance']
@@ -34,6 +42,43 @@ def update_plugin_positions(**kwargs):
 signals.post_delete.connect(update_plugin_positions, sender=CMSPlugin, dispatch_uid="cms.plugin.update_position")
 
 
+def invalidate_page_cache_for_plugin(instance, **kwargs):
+    # plugins are saved through their own (sub)classes, so the sender can't be
+    # used to filter
+    if isinstance(instance, CMSPlugin):
+        invalidate_page_cache()
+
+
+signals.post_save.connect(invalidate_page_cache_for_plugin, dispatch_uid="cms.plugin.page_cache")
+signals.post_delete.connect(invalidate_page_cache_for_plugin, dispatch_uid="cms.plugin.delete.page_cache")
+
+
+def invalidate_placeholder_cache_for_plugin(instance, **kwargs):
+    # the cached output of plugins is keyed by the generation of their
+    # placeholder, too
+    if isinstance(instance, CMSPlugin):
+        invalidate_placeholder_cache([instance.placeholder_id])
+
+
+def invalidate_placeholder_cache_for_moved_plugin(instance, raw, **kwargs):
+    # a plugin moved to another placeholder disappears from its old one
+    if isinstance(instance, CMSPlugin) and instance.pk and not raw:
+        invalidate_placeholder_cache(CMSPlugin.objects.filter(pk=instance.pk).exclude(
+            placeholder=instance.placeholder_id).values_list('placeholder_id', flat=True))
+
+
+def invalidate_placeholder_cache_for_page(instance, raw, **kwargs):
+    # covers publishing, which saves the public copy of the page
+    if not raw:
+        invalidate_placeholder_cache(Placeholder.objects.filter(page=instance.pk).values_list('pk', flat=True))
+
+
+signals.pre_save.connect(invalidate_placeholder_cache_for_moved_plugin, dispatch_uid="cms.plugin.move.placeholder_cache")
+signals.post_save.connect(invalidate_placeholder_cache_for_plugin, dispatch_uid="cms.plugin.placeholder_cache")
+signals.post_delete.connect(invalidate_placeholder_cache_for_plugin, dispatch_uid="cms.plugin.delete.placeholder_cache")
+signals.post_save.connect(invalidate_placeholder_cache_for_page, sender=Page, dispatch_uid="cms.page.placeholder_cache")
+
+
 def update_title_paths(instance, **kwargs):
     """Update child pages paths in case when page was moved.
     """
@@ -203,6 +248,19 @@ def update_placeholders(instance, **kwargs):
 def invalidate_menu_cache(instance, **kwargs):
     menu_pool.clear(instance.site_id)
 
+
+def invalidate_page_resolver_cache(instance, **kwargs):
+    # Page saves cover publish, unpublish and move, Title saves cover slug and
+    # path changes. Connected to post_* signals so processes rebuilding
+    # their routing index see the new state.
+    clear_page_resolver_cache()
+
+
+def warm_menus(instance, **kwargs):
+    # publishing cleared the menus, build them before visitors ask for them
+    if get_cms_setting('MENU_WARM_ON_PUBLISH'):
+        menu_pool.warm()
+
 # tell moderator, there is something happening with this page
 signals.pre_save.connect(pre_save_page, sender=Page, dispatch_uid="cms.page.presave")
 signals.post_save.connect(post_save_page_moderator, sender=Page, dispatch_uid="cms.page.postsave")
@@ -210,6 +268,15 @@ signals.post_save.connect(post_save_page, sender=Page)
 signals.post_save.connect(update_placeholders, sender=Page)
 signals.pre_save.connect(invalidate_menu_cache, sender=Page)
 signals.pre_delete.connect(invalidate_menu_cache, sender=Page)
+signals.post_save.connect(invalidate_page_resolver_cache, sender=Page,
+                          dispatch_uid="cms.page.page_resolver")
+signals.post_delete.connect(invalidate_page_resolver_cache, sender=Page,
+                            dispatch_uid="cms.page.delete.page_resolver")
+signals.post_save.connect(invalidate_page_resolver_cache, sender=Title,
+                          dispatch_uid="cms.title.page_resolver")
+signals.post_delete.connect(invalidate_page_resolver_cache, sender=Title,
+                            dispatch_uid="cms.title.delete.page_resolver")
+post_publish.connect(warm_menus, sender=Page, dispatch_uid="cms.page.warm_menus")
 
 
 def pre_save_user(instance, raw, **kwargs):
@@ -241,10 +308,13 @@ def _clear_users_permissions(instance):
 
 def pre_save_pagepermission(instance, raw, **kwargs):
     _clear_users_permissions(instance)
+    # view restrictions decide whether anonymous visitors may see cached pages
+    invalidate_page_cache()
 
 
 def pre_delete_pagepermission(instance, **kwargs):
     _clear_users_permissions(instance)
+    invalidate_page_cache()
 
 
 def pre_save_globalpagepermission(instance, raw, **kwargs):
@@ -1,12 +1,10 @@
 # -*- coding: utf-8 -*-
-from itertools import chain
-
 from classytags.arguments import Argument, MultiValueArgument
 from classytags.core import Options, Tag
 from classytags.helpers import InclusionTag, AsTag
 from classytags.parser import Parser
 from cms.models import Page, Placeholder as PlaceholderModel
-from cms.plugin_rendering import render_placeholder
+from cms.plugin_rendering import render_cached_placeholder, render_placeholder, restore_sekizai
 from cms.plugins.utils import get_plugins, assign_plugins
 from cms.utils import get_language_from_request, get_cms_setting
 from cms.utils.page_resolver import get_page_queryset, use_draft
@@ -20,7 +18,7 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _, get_language
 import re
-from sekizai.helpers import Watcher, get_varname
+from sekizai.helpers import Watcher
 
 
 register = template.Library()
@@ -156,36 +154,106 @@ def _get_placeholder(current_page, page, context, name):
         return placeholder_cache[page.pk].get(name, None)
     placeholder_cache[page.pk] = {}
     slots = get_placeholders(page.get_template())
-    placeholders = page.placeholders.filter(slot__in=slots)
-    assign_plugins(context['request'], placeholders, get_language())
+    placeholders = list(page.placeholders.filter(slot__in=slots))
     for placeholder in placeholders:
         placeholder_cache[page.pk][placeholder.slot] = placeholder
         placeholder.page = page
     current_page._tmp_placeholders_cache = placeholder_cache
+    _add_pending_placeholders(current_page, placeholders)
     return placeholder_cache[page.pk].get(name, None)
 
 
+def _add_pending_placeholders(current_page, placeholders):
+    pending = getattr(current_page, '_tmp_pending_placeholders', [])
+    current_page._tmp_pending_placeholders = pending + placeholders
+
+
+def _assign_pending_plugins(current_page, context):
+    """
+    Fetches the plugins of all placeholders fetched for the page so far which
+    don't have them yet, in one query. Plugins are only fetched once a
+    placeholder isn't found in the placeholder cache.
+    """
+    pending = getattr(current_page, '_tmp_pending_placeholders', [])
+    if pending:
+        assign_plugins(context['request'], pending, get_language())
+        current_page._tmp_pending_placeholders = []
+
+
+def _get_inherited_placeholders(current_page, pages, context, name):
+    """
+    Returns the placeholder called ``name`` of each of the given pages, or None
+    for pages which don't have it. The placeholders which aren't known yet are
+    fetched in one query, their plugins later by _assign_pending_plugins.
+    """
+    from cms.utils.plugins import get_placeholders
+
+    placeholder_cache = getattr(current_page, '_tmp_placeholders_cache', {})
+    slot_cache = getattr(current_page, '_tmp_slot_placeholders_cache', {})
+    missing = [page for page in pages
+               if page.pk not in placeholder_cache and (page.pk, name) not in slot_cache]
+    if missing:
+        relations = Page.placeholders.through.objects.filter(
+            page__in=[page.pk for page in missing], placeholder__slot=name).select_related('placeholder')
+        found = dict((relation.page_id, relation.placeholder) for relation in relations)
+        placeholders = []
+        for page in missing:
+            placeholder = found.get(page.pk)
+            if placeholder is not None and name not in get_placeholders(page.get_template()):
+                placeholder = None
+            if placeholder is not None:
+                placeholder.page = page
+                placeholders.append(placeholder)
+            slot_cache[(page.pk, name)] = placeholder
+        current_page._tmp_slot_placeholders_cache = slot_cache
+        _add_pending_placeholders(current_page, placeholders)
+    return [placeholder_cache[page.pk].get(name, None) if page.pk in placeholder_cache
+            else slot_cache[(page.pk, name)] for page in pages]
+
+
+def _render_first_placeholder(context, request, current_page, placeholders, name):
+    """
+    Returns the output of the first of the given placeholders which has any,
+    or None.
+    """
+    for placeholder in placeholders:
+        if placeholder is None:
+            continue
+        # the plugins are only needed if the output isn't cached
+        content = render_cached_placeholder(placeholder, context)
+        if content is None:
+            _assign_pending_plugins(current_page, context)
+            if not get_plugins(request, placeholder):
+                continue
+            content = render_placeholder(placeholder, context, name)
+        if content:
+            return content
+    return None
+
+
 def get_placeholder_content(context, request, current_page, name, inherit):
     edit_mode = getattr(request, 'toolbar', None) and getattr(request.toolbar, 'edit_mode')
-    pages = [current_page]
+    placeholder = _get_placeholder(current_page, current_page, context, name)
+    content = _render_first_placeholder(context, request, current_page, [placeholder], name)
+    if content:
+        return content
     # don't display inherited plugins in edit mode, so that the user doesn't
     # mistakenly edit/delete them. This is a fix for issue #1303. See the discussion
     # there for possible enhancements
     if inherit and not edit_mode:
-        pages = chain([current_page], current_page.get_cached_ancestors(ascending=True))
-    for page in pages:
-        placeholder = _get_placeholder(current_page, page, context, name)
-        if placeholder is None:
-            continue
-        if not get_plugins(request, placeholder):
-            continue
-        content = render_placeholder(placeholder, context, name)
+        # the ancestors are only needed if the page's own placeholder is empty
+        ancestors = list(current_page.get_cached_ancestors(ascending=True))
+        placeholders = _get_inherited_placeholders(current_page, ancestors, context, name)
+        content = _render_first_placeholder(context, request, current_page, placeholders, name)
         if content:
             return content
-            # if we reach this point, we have an empty or non-existant placeholder
-            # call _get_placeholder again to get the placeholder properly rendered
-            # in frontend editing
-    placeholder = _get_placeholder(current_page, current_page, context, name)
+    # if we reach this point, we have an empty or non-existant placeholder
+    # render it again to get the placeholder properly rendered in frontend
+    # editing
+    content = render_cached_placeholder(placeholder, context)
+    if content is not None:
+        return content
+    _assign_pending_plugins(current_page, context)
     return render_placeholder(placeholder, context, name)
 
 
@@ -393,15 +461,6 @@ class CleanAdminListFilter(InclusionTag):
         return {'title': spec.title(), 'choices': unique_choices}
 
 
-def _restore_sekizai(context, changes):
-    varname = get_varname()
-    sekizai_container = context[varname]
-    for key, values in changes.items():
-        sekizai_namespace = sekizai_container[key]
-        for value in values:
-            sekizai_namespace.append(value)
-
-
 def _show_placeholder_for_page(context, placeholder_name, page_lookup, lang=None,
                                site=None, cache_result=True):
     """
@@ -428,7 +487,7 @@ def _show_placeholder_for_page(context, placeholder_name, page_lookup, lang=None
         cache_key = _clean_key('%s_placeholder:%s' % (base_key, placeholder_name))
         cached_value = cache.get(cache_key)
         if isinstance(cached_value, dict): # new style
-            _restore_sekizai(context, cached_value['sekizai'])
+            restore_sekizai(context, cached_value['sekizai'])
             return {'content': mark_safe(cached_value['content'])}
         elif isinstance(cached_value, basestring): # old style
             return {'content': mark_safe(cached_value)}
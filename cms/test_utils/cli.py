@@ -95,6 +95,7 @@ def configure(db_url, **extra):
             'cms.test_utils.project.pluginapp',
             'cms.test_utils.project.pluginapp.plugins.manytomany_rel',
             'cms.test_utils.project.pluginapp.plugins.extra_context',
+            'cms.test_utils.project.pluginapp.plugins.multi_level',
             'cms.test_utils.project.fakemlng',
             'cms.test_utils.project.fileapp',
             'south',
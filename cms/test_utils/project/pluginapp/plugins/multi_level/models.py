@@ -0,0 +1,14 @@
+from django.db import models
+
+from cms.models import CMSPlugin
+
+
+class ParentPluginModel(CMSPlugin):
+    title = models.CharField(max_length=50)
+
+
+class ChildPluginModel(ParentPluginModel):
+    """
+    A plugin model inheriting from another plugin model.
+    """
+    subtitle = models.CharField(max_length=50)
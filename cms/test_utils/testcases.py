@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from cms.cache.page_resolver import clear_page_resolver_cache
 from cms.models import Page
 from cms.test_utils.util.context_managers import (UserLoginContext,
     SettingsOverride)
@@ -88,6 +89,8 @@ class CMSTestCase(testcases.TestCase):
     def _post_teardown(self):
         # Needed to clean the menu keys cache, see menu.menu_pool.clear()
         menu_pool.clear()
+        # The database is rolled back without signals, drop routing indexes
+        clear_page_resolver_cache()
         super(CMSTestCase, self)._post_teardown()
         set_current_user(None)
 
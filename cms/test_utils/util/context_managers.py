@@ -27,6 +27,8 @@ class SettingsOverride(object):
         self.overrides = overrides
         self.special_handlers = {
             'TEMPLATE_CONTEXT_PROCESSORS': self.template_context_processors,
+            'CMS_PLUGIN_PROCESSORS': self.plugin_processors,
+            'CMS_PLUGIN_CONTEXT_PROCESSORS': self.plugin_processors,
         }
         
     def __enter__(self):
@@ -34,6 +36,7 @@ class SettingsOverride(object):
         for key, value in self.overrides.items():
             self.old[key] = getattr(settings, key, NULL)
             setattr(settings, key, value)
+            self.special_handlers.get(key, lambda:None)()
         
     def __exit__(self, type, value, traceback):
         for key, value in self.old.items():
@@ -46,6 +49,10 @@ class SettingsOverride(object):
     def template_context_processors(self):
         context._standard_context_processors = None
 
+    def plugin_processors(self):
+        from cms.plugin_rendering import clear_processor_chains
+        clear_processor_chains()
+
 
 class StdOverride(object):
     def __init__(self, std='out', buffer=None):
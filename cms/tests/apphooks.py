@@ -3,7 +3,7 @@ from __future__ import with_statement
 from cms.api import create_page, create_title
 from cms.apphook_pool import apphook_pool
 from cms.appresolver import (applications_page_check, clear_app_resolvers,
-    get_app_patterns)
+    get_app_patterns, get_app_url_resolver, APP_URL_RESOLVERS, AppResolverTrie)
 from cms.test_utils.testcases import CMSTestCase, SettingsOverrideTestCase
 from cms.test_utils.util.context_managers import SettingsOverride
 from cms.tests.menu_utils import DumbPageLanguageUrl
@@ -365,6 +365,53 @@ class ApphooksTestCase(CMSTestCase):
 
             apphook_pool.clear()
 
+    def test_app_url_resolver_cached(self):
+        with SettingsOverride(ROOT_URLCONF='cms.test_utils.project.second_urls_for_apphook_tests'):
+            en_title, de_title = self.create_base_structure(APP_NAME, ['en', 'de'])
+            with force_language("en"):
+                resolver = get_app_url_resolver(APP_NAME)
+                self.assertTrue(resolver is get_app_url_resolver(APP_NAME))
+                response = self.client.get(reverse('sample-settings'))
+                self.assertEquals(response.status_code, 200)
+                self.assertTrue(resolver is get_app_url_resolver(APP_NAME))
+            with force_language("de"):
+                self.assertFalse(resolver is get_app_url_resolver(APP_NAME))
+            self.assertEqual(len(APP_URL_RESOLVERS), 2)
+            # changing the application of a title drops the compiled resolvers
+            en_title.application_urls = ''
+            en_title.save()
+            self.assertEqual(len(APP_URL_RESOLVERS), 0)
+            get_app_url_resolver(APP_NAME)
+            clear_app_resolvers()
+            self.assertEqual(len(APP_URL_RESOLVERS), 0)
+            apphook_pool.clear()
+
+    def test_app_resolver_trie(self):
+        trie = AppResolverTrie()
+        trie.add('blog/archive', 'archive')
+        trie.add('', 'root')
+        trie.add('blog', 'blog')
+        trie.add('shop/', 'shop')
+        # the resolvers are tried in the order of the apphook patterns
+        self.assertEqual(trie.get_resolvers('blog/archive/2013/'), ['archive', 'root', 'blog'])
+        self.assertEqual(trie.get_resolvers('blog/2013/'), ['root', 'blog'])
+        self.assertEqual(trie.get_resolvers('blogger/'), ['root'])
+        self.assertEqual(trie.get_resolvers('shop/cart/'), ['root', 'shop'])
+
+    def test_get_page_for_apphook_queries(self):
+        with SettingsOverride(ROOT_URLCONF='cms.test_utils.project.second_urls_for_apphook_tests'):
+            en_title, de_title = self.create_base_structure(APP_NAME, ['en', 'de'])
+            with force_language("en"):
+                path = reverse('sample-settings')
+                request = self.get_request(path)
+                attached_to_page = applications_page_check(request, path=path[1:])
+                self.assertEquals(attached_to_page.pk, en_title.page.pk)
+                with self.assertNumQueries(0):
+                    attached_to_page = applications_page_check(request, path=path[1:])
+                self.assertEquals(attached_to_page.pk, en_title.page.pk)
+                self.assertEqual(applications_page_check(request, path='en/child_page/'), None)
+            apphook_pool.clear()
+
 
 class ApphooksPageLanguageUrlTestCase(SettingsOverrideTestCase):
 
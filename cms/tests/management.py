@@ -2,6 +2,7 @@
 from __future__ import with_statement
 from StringIO import StringIO
 from django.core import management
+from django.template import Template
 
 from cms.test_utils.testcases import CMSTestCase
 from cms.test_utils.util.context_managers import SettingsOverride
@@ -224,3 +225,26 @@ class ManagementTestCase(CMSTestCase):
             command.handle("uninstall", "plugins", PLUGIN, interactive=False)
             self.assertEqual(out.getvalue(), "1 'TextPlugin' plugins uninstalled\n")
             self.assertEqual(CMSPlugin.objects.filter(plugin_type=PLUGIN).count(), 0)
+
+    def test_warm_menus(self):
+        create_page('Hello Title', "nav_playground.html", "en", published=True, in_navigation=True)
+        out = StringIO()
+        command = cms.Command()
+        command.stdout = out
+        command.handle("warm_menus", "en", interactive=False)
+        self.assertEqual(out.getvalue(), "warmed menus for languages: en\n")
+        context = self.get_context('/')
+        tpl = Template("{% load menu_tags %}{% show_menu %}")
+        with self.assertNumQueries(0):
+            tpl.render(context)
+        self.assertEqual(len(context['children']), 1)
+
+    def test_warm_menus_on_publish(self):
+        page = create_page('Hello Title', "nav_playground.html", "en", in_navigation=True)
+        with SettingsOverride(CMS_MENU_WARM_ON_PUBLISH=True):
+            page.publish()
+        context = self.get_context('/')
+        tpl = Template("{% load menu_tags %}{% show_menu %}")
+        with self.assertNumQueries(0):
+            tpl.render(context)
+        self.assertEqual(len(context['children']), 1)
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
 import copy
+import cPickle as pickle
+import time
+from django.core.cache import cache
 from django.db import connection
 from cms.api import create_page
-from cms.menu import CMSMenu, get_visible_pages
-from cms.models import Page
-from cms.models.permissionmodels import GlobalPagePermission, PagePermission
+from cms.menu import CMSMenu, get_restricted_pages, get_visible_pages
+from cms.models import Page, Title
+from cms.models.permissionmodels import (ACCESS_CHILDREN, ACCESS_DESCENDANTS,
+    ACCESS_PAGE_AND_DESCENDANTS, GlobalPagePermission, PagePermission)
 from cms.test_utils.fixtures.menus import (MenusFixture, SubMenusFixture, 
     SoftrootFixture, ExtendedMenusFixture)
 from cms.test_utils.testcases import SettingsOverrideTestCase
@@ -19,9 +23,10 @@ from django.contrib.auth.models import AnonymousUser, User, Permission, Group
 from django.contrib.sites.models import Site
 from django.template import Template, TemplateSyntaxError
 from django.utils.translation import activate
-from menus.base import NavigationNode
-from menus.menu_pool import menu_pool, _build_nodes_inner_for_one_menu
-from menus.models import CacheKey
+from menus.base import CompactNodes, Menu, Modifier, NavigationNode, get_node_views, is_visitor, visit_nodes
+from menus import menu_pool as menu_pool_module
+from menus.menu_pool import menu_pool, _build_nodes_inner_for_one_menu, _get_tree_index, _get_url_index
+from menus.modifiers import Level
 from menus.utils import mark_descendants, find_selected, cut_levels
 from django.utils.unittest.case import skipUnless
 
@@ -57,6 +62,30 @@ class BaseMenuTest(SettingsOverrideTestCase):
     def get_page(self, num):
         return Page.objects.public().get(title_set__title='P%s' % num)
 
+    def _describe_menu(self, nodes):
+        return [(node.title, node.level, node.selected, node.ancestor, node.descendant, node.sibling,
+                 node.is_leaf_node, self._describe_menu(node.children)) for node in nodes]
+
+    def assertBoundedMenu(self, path, root_id=None):
+        """
+        Checks that show_menu renders the same menus when only the nodes
+        surviving the cut are built.
+        """
+        for from_level in (0, 1):
+            for to_level in (0, 1, 100):
+                for extra_inactive in (0, 1):
+                    for extra_active in (0, 100):
+                        levels = (from_level, to_level, extra_inactive, extra_active)
+                        menus = []
+                        for bounded in (False, True):
+                            tpl = Template("{%% load menu_tags %%}{%% show_menu %s %s %s %s 'menu/menu.html' None %s %%}"
+                                           % (levels + (root_id and "'%s'" % root_id or 'None',)))
+                            with SettingsOverride(CMS_MENU_BOUNDED_NODES=bounded):
+                                context = self.get_context(path)
+                                tpl.render(context)
+                            menus.append(self._describe_menu(context['children']))
+                        self.assertEqual(menus[0], menus[1], "%s %s" % (path, levels))
+
 class ExtendedFixturesMenuTests(ExtendedMenusFixture, BaseMenuTest):
     """
     Tree from fixture:
@@ -90,6 +119,79 @@ class ExtendedFixturesMenuTests(ExtendedMenusFixture, BaseMenuTest):
             tpl = Template("{% load menu_tags %}{% show_menu 0 0 0 0 'menu/menu.html' child %}")
             self.assertRaises(TemplateSyntaxError, tpl.render, context)
 
+    def test_show_menu_bounded(self):
+        paths = ['/', '/unknown/'] + [page.get_absolute_url() for page in self.get_all_pages()]
+        for path in paths:
+            self.assertBoundedMenu(path)
+        page = self.get_page(1)
+        Page.objects.filter(pk=page.pk).update(reverse_id='p1')
+        menu_pool.clear(settings.SITE_ID)
+        for path in paths:
+            self.assertBoundedMenu(path, 'p1')
+        with SettingsOverride(CMS_SOFTROOT=True):
+            Page.objects.filter(pk=self.get_page(9).pk).update(soft_root=True)
+            menu_pool.clear(settings.SITE_ID)
+            for path in paths:
+                self.assertBoundedMenu(path)
+
+    def test_show_breadcrumb_selected_path(self):
+        paths = ['/', '/unknown/'] + [page.get_absolute_url() for page in self.get_all_pages()]
+        tpl = Template("{% load menu_tags %}{% show_breadcrumb 0 'menu/breadcrumb.html' 0 %}"
+                       "{% show_breadcrumb 1 %}")
+
+        def render(path, full):
+            if not full:
+                with SettingsOverride(CMS_MENU_BOUNDED_NODES=True):
+                    context = self.get_context(path)
+                    return tpl.render(context)
+            menu_pool.get_breadcrumb_nodes = lambda request, home_url: menu_pool.get_nodes(request, breadcrumb=True)
+            try:
+                context = self.get_context(path)
+                return tpl.render(context)
+            finally:
+                del menu_pool.get_breadcrumb_nodes
+
+        for path in paths:
+            self.assertEqual(render(path, False), render(path, True), path)
+        Page.objects.filter(pk=self.get_page(1).pk).update(in_navigation=False)
+        with SettingsOverride(CMS_SOFTROOT=True):
+            Page.objects.filter(pk=self.get_page(9).pk).update(soft_root=True)
+            menu_pool.clear(settings.SITE_ID)
+            for path in paths:
+                self.assertEqual(render(path, False), render(path, True), path)
+        # the selected path is only built if enabled
+        request = self.get_request('/')
+        nodes = menu_pool.get_nodes(request, breadcrumb=True)
+        self.assertEqual(len(menu_pool.get_breadcrumb_nodes(request, '/')), len(nodes))
+        with SettingsOverride(CMS_MENU_BOUNDED_NODES=True):
+            self.assertTrue(len(menu_pool.get_breadcrumb_nodes(request, '/')) < len(nodes))
+        calls = []
+        get_node_views = menu_pool_module.get_node_views
+        menu_pool_module.get_node_views = lambda nodes: calls.append(len(nodes)) or get_node_views(nodes)
+        try:
+            render(self.get_page(11).get_absolute_url(), False)
+        finally:
+            menu_pool_module.get_node_views = get_node_views
+        # P1, P9, P10 and P11 for both tags
+        self.assertEqual(calls, [4, 4])
+
+    def test_show_menu_bounded_queries(self):
+        with SettingsOverride(CMS_MENU_BOUNDED_NODES=True):
+            context = self.get_context(self.get_page(3).get_absolute_url())
+            tpl = Template("{% load menu_tags %}{% show_menu 0 0 0 0 %}")
+            tpl.render(context)
+            calls = []
+            get_node_views = menu_pool_module.get_node_views
+            menu_pool_module.get_node_views = lambda nodes: calls.append(len(nodes)) or get_node_views(nodes)
+            try:
+                context = self.get_context(self.get_page(3).get_absolute_url())
+                tpl.render(context)
+            finally:
+                menu_pool_module.get_node_views = get_node_views
+            # all nodes but P10 and P11, which are below the cut P9
+            self.assertEqual(calls, [9])
+            self.assertEqual([node.title for node in context['children']], ['P1', 'P4'])
+
     def test_show_submenu_nephews(self):
         context = self.get_context(path=self.get_page(2).get_absolute_url())
         tpl = Template("{% load menu_tags %}{% show_sub_menu 100 1 1 %}")
@@ -172,39 +274,164 @@ class FixturesMenuTests(MenusFixture, BaseMenuTest):
     def test_show_menu_num_queries(self):
         context = self.get_context()
         # test standard show_menu
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(3):
             """
             The queries should be:
                 get all pages
                 get all page permissions
                 get all titles
-                get the menu cache key
-                set the menu cache key
             """
             tpl = Template("{% load menu_tags %}{% show_menu %}")
             tpl.render(context)
 
-    def test_show_menu_cache_key_leak(self):
+    def test_show_menu_cached(self):
         context = self.get_context()
         tpl = Template("{% load menu_tags %}{% show_menu %}")
-        self.assertEqual(CacheKey.objects.count(), 0)
         tpl.render(context)
-        self.assertEqual(CacheKey.objects.count(), 1)
-        tpl.render(context)
-        self.assertEqual(CacheKey.objects.count(), 1)
+        with self.assertNumQueries(0):
+            tpl.render(context)
 
-    def test_menu_keys_duplicate_truncates(self):
+    def test_menu_fragment_cache(self):
+        tpl = Template("{% load menu_tags %}{% show_menu 0 100 0 100 %}|{% show_breadcrumb %}")
+        with SettingsOverride(CMS_MENU_FRAGMENT_CACHE=True):
+            path = self.get_page(2).get_absolute_url()
+            context = self.get_context(path)
+            output = tpl.render(context)
+            self.assertTrue('children' in context)
+            # the same node is selected
+            context = self.get_context(path + 'unknown/')
+            with self.assertNumQueries(0):
+                self.assertEqual(tpl.render(context), output)
+            self.assertFalse('children' in context)
+            # hits don't need the menu
+            menu_pool._build_nodes = None
+            try:
+                context = self.get_context(path + 'unknown/')
+                self.assertEqual(tpl.render(context), output)
+            finally:
+                del menu_pool._build_nodes
+            context = self.get_context(self.get_page(3).get_absolute_url())
+            self.assertNotEqual(tpl.render(context), output)
+            Title.objects.filter(page=self.get_page(2)).update(menu_title='changed')
+            context = self.get_context(path)
+            self.assertEqual(tpl.render(context), output)
+            menu_pool.clear(settings.SITE_ID)
+            context = self.get_context(path)
+            self.assertTrue('changed' in tpl.render(context))
+
+    def test_menu_build_waits_for_other_builder(self):
+        request = self.get_request()
+        site_id = settings.SITE_ID
+        nodes = menu_pool._build_nodes(request, site_id)
+        key = menu_pool._get_cache_key(request, site_id, 'en')
+        cache.delete(key)
+        # another process is building the nodes
+        cache.add("%s_lock" % key, True)
+        sleep = menu_pool_module.time.sleep
+        build_lock_timeout = menu_pool_module.BUILD_LOCK_TIMEOUT
+        menu_pool_module.time.sleep = lambda seconds: cache.set(key, nodes)
+        try:
+            with self.assertNumQueries(0):
+                self.assertEqual(len(menu_pool._build_nodes(request, site_id)[0]), len(nodes[0]))
+            # the other process failed
+            cache.delete(key)
+            menu_pool_module.time.sleep = lambda seconds: cache.delete("%s_lock" % key)
+            cache.add("%s_lock" % key, True)
+            self.assertEqual(len(menu_pool._build_nodes(request, site_id)[0]), len(nodes[0]))
+            self.assertTrue(cache.get(key))
+            self.assertEqual(cache.get("%s_lock" % key), None)
+            # waiting for the other process timed out, its lock stays
+            cache.delete(key)
+            menu_pool_module.time.sleep = lambda seconds: None
+            menu_pool_module.BUILD_LOCK_TIMEOUT = 0
+            cache.add("%s_lock" % key, True)
+            self.assertEqual(len(menu_pool._build_nodes(request, site_id)[0]), len(nodes[0]))
+            self.assertTrue(cache.get("%s_lock" % key))
+        finally:
+            menu_pool_module.time.sleep = sleep
+            menu_pool_module.BUILD_LOCK_TIMEOUT = build_lock_timeout
+            cache.delete("%s_lock" % key)
+
+    def test_menu_cache_shared_by_visibility(self):
         """
-        When two objects with the same characteristics are present in the
-        database, get_or_create truncates the database table to "invalidate"
-        the cache, before retrying. This can happen after migrations, and since
-        it's only cache, we don't want any propagation of errors.
+        Users who see the same pages share one cached menu
         """
-        CacheKey.objects.create(language="fr", site=1, key="a")
-        CacheKey.objects.create(language="fr", site=1, key="a")
-        CacheKey.objects.get_or_create(language="fr", site=1, key="a")
-
-        self.assertEqual(CacheKey.objects.count(), 1)
+        first = User.objects.create_user('first', 'first@domain.com', 'first')
+        second = User.objects.create_user('second', 'second@domain.com', 'second')
+        restricted = User.objects.create_user('restricted', 'restricted@domain.com', 'restricted')
+        PagePermission.objects.create(can_view=True, user=restricted, page=self.get_page(2))
+        self.user = first
+        menu_pool.get_nodes(self.get_request())
+        self.user = second
+        with self.assertNumQueries(4):
+            """
+            The queries are:
+                global view permission of the user
+                page view permissions of the user
+                user permissions
+                group permissions
+            """
+            menu_pool.get_nodes(self.get_request())
+        self.user = restricted
+        nodes = menu_pool.get_nodes(self.get_request())
+        self.assertTrue(self.get_page(2).pk in [node.id for node in nodes])
+        self.user = second
+        nodes = menu_pool.get_nodes(self.get_request())
+        self.assertFalse(self.get_page(2).pk in [node.id for node in nodes])
+
+    def test_menu_cache_per_user_for_other_menus(self):
+        """
+        Menus which do not opt in may contain user specific nodes, so every
+        user gets their own cached menu
+        """
+        class UserMenu(Menu):
+            def get_nodes(self, request):
+                return [NavigationNode(request.user.username, '/user/', 1)]
+
+        menu_pool.menus['UserMenu'] = UserMenu()
+        first = User.objects.create_user('first', 'first@domain.com', 'first')
+        second = User.objects.create_user('second', 'second@domain.com', 'second')
+        self.user = first
+        nodes = menu_pool.get_nodes(self.get_request())
+        self.assertTrue('first' in [node.title for node in nodes])
+        self.user = second
+        nodes = menu_pool.get_nodes(self.get_request())
+        self.assertTrue('second' in [node.title for node in nodes])
+        self.assertFalse('first' in [node.title for node in nodes])
+
+    def test_menu_cache_clear(self):
+        request = self.get_request()
+        site_id = settings.SITE_ID
+
+        def get_key():
+            return menu_pool._get_cache_key(request, site_id, 'en')
+
+        key = get_key()
+        self.assertEqual(get_key(), key)
+        menu_pool.clear(site_id + 1)
+        menu_pool.clear(language='fr')
+        menu_pool.clear(site_id, 'fr')
+        self.assertEqual(get_key(), key)
+        for kwargs in ({'site_id': site_id}, {'language': 'en'},
+                       {'site_id': site_id, 'language': 'en'}, {'all': True}, {}):
+            menu_pool.clear(**kwargs)
+            self.assertNotEqual(get_key(), key, kwargs)
+            key = get_key()
+
+    def test_menu_cache_without_database_writes(self):
+        context = self.get_context()
+        menu_pool.clear(settings.SITE_ID)
+        tpl = Template("{% load menu_tags %}{% show_menu %}")
+        with self.assertNumQueries(3):
+            """
+            The queries should be:
+                get all pages
+                get all page permissions
+                get all titles
+            """
+            tpl.render(context)
+        with self.assertNumQueries(0):
+            menu_pool.clear(settings.SITE_ID)
 
     def test_only_active_tree(self):
         context = self.get_context()
@@ -565,6 +792,239 @@ class MenuTests(BaseMenuTest):
         self.assertEqual(node4.children, [node3])
         self.assertEqual(node5.children, [node4])
 
+    def test_build_nodes_inner_for_unordered_menu(self):
+        '''
+            Nodes given before their parents keep the order in which they
+            were given, after the nodes that could be linked right away
+
+            node1
+             node3
+              node4
+             node2
+              node5
+        '''
+        node2 = NavigationNode('Test2', '/test2/', 2, 1)
+        node4 = NavigationNode('Test4', '/test4/', 4, 3)
+        node1 = NavigationNode('Test1', '/test1/', 1, None)
+        node3 = NavigationNode('Test3', '/test3/', 3, 1)
+        node5 = NavigationNode('Test5', '/test5/', 5, 2)
+
+        nodes = [node2, node4, node1, node3, node5]
+        final_list = _build_nodes_inner_for_one_menu(nodes, 'Test')
+        self.assertEqual(final_list, [node1, node3, node2, node4, node5])
+        self.assertEqual(node1.children, [node3, node2])
+        self.assertEqual(node2.children, [node5])
+        self.assertEqual(node3.children, [node4])
+        self.assertEqual(node5.parent, node2)
+        self.assertEqual(node5.parent_namespace, 'Test')
+
+    def _build_synthetic_menu(self, count, reverse):
+        # every node has ten children, the orphans have no parent at all
+        lookups = []
+
+        class CountingNode(NavigationNode):
+            # counts how often the builder looks at the parent of a node
+            def _get_parent_id(self):
+                lookups.append(self)
+                return self._parent_id
+
+            def _set_parent_id(self, parent_id):
+                self._parent_id = parent_id
+
+            parent_id = property(_get_parent_id, _set_parent_id)
+
+        nodes = [CountingNode('Test%s' % i, '/test%s/' % i, i, (i - 1) // 10 or None)
+                 for i in range(1, count + 1)]
+        orphans = [CountingNode('Orphan%s' % i, '/orphan%s/' % i, -i, -i - 1)
+                   for i in range(1, count // 100 + 1)]
+        nodes += orphans
+        if reverse:
+            nodes.reverse()
+        final_list = _build_nodes_inner_for_one_menu(nodes, 'Test')
+        self.assertEqual(len(final_list), count)
+        self.assertEqual(len(final_list[-1].children), 0)
+        for orphan in orphans:
+            self.assertEqual(orphan.parent, None)
+        return len(lookups)
+
+    def test_build_nodes_inner_for_large_menu(self):
+        '''
+        Benchmark: building trees of 10k and 100k nodes must look at every
+        node a constant number of times, so the work grows linearly with the
+        number of nodes, also when children come before their parents or
+        there are orphans.
+        '''
+        for reverse in (False, True):
+            small = self._build_synthetic_menu(10000, reverse)
+            large = self._build_synthetic_menu(100000, reverse)
+            # both include 1% orphans
+            self.assertTrue(small <= 4 * 10100 and large <= 4 * 101000,
+                            "10k nodes: %s lookups, 100k nodes: %s lookups" % (small, large))
+
+    def _build_page_like_menu(self, count):
+        # nodes like the ones of CMSMenu, every node has ten children
+        nodes = []
+        for i in range(1, count + 1):
+            attr = {'soft_root': False, 'auth_required': False, 'reverse_id': None,
+                    'visible_for_authenticated': True, 'visible_for_anonymous': True,
+                    'redirect_url': None}
+            if i == 1:
+                attr['is_home'] = True
+            nodes.append(NavigationNode(u'Page %s' % i, u'/page/%s/' % i, i, (i - 1) // 10 or None,
+                                        attr=attr))
+        nodes = _build_nodes_inner_for_one_menu(nodes, 'CMSMenu')
+        roots, children, parents, reverse_ids = _get_tree_index(nodes)
+        return nodes, CompactNodes(nodes, children, parents)
+
+    def test_compact_nodes(self):
+        nodes, compact = self._build_page_like_menu(30)
+        extra = NavigationNode('Extra', '/page/3/extra/', 'extra', 3)
+        extra.namespace = 'CMSMenu'
+        extra.custom = 'custom'
+        nodes.append(extra)
+        extra.parent = nodes[2]
+        nodes[2].children.append(extra)
+        roots, children, parents, reverse_ids = _get_tree_index(nodes)
+        compact = pickle.loads(pickle.dumps(CompactNodes(nodes, children, parents), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(len(compact), len(nodes))
+        for node, decoded in zip(nodes, compact):
+            for name in ('namespace', 'title', 'url', 'id', 'parent_id', 'parent_namespace',
+                         'visible', 'attr'):
+                self.assertEqual(getattr(decoded, name), getattr(node, name))
+            self.assertEqual([child.id for child in decoded.children],
+                             [child.id for child in node.children])
+            self.assertEqual(decoded.parent and decoded.parent.id, node.parent and node.parent.id)
+        self.assertTrue(compact[0] is compact[0])
+        self.assertTrue(compact[1].children[0] is compact[20])
+        self.assertEqual(compact[-1].custom, 'custom')
+        self.assertTrue(compact[-1].parent is compact[2])
+        self.assertTrue(compact[-1] in compact[2].children)
+        self.assertTrue(compact[0].get_attribute('is_home'))
+        self.assertFalse(compact[1].get_attribute('is_home'))
+        views = get_node_views(list(compact))
+        self.assertEqual(views[0].children, views[10:20])
+        self.assertEqual(views[10].parent, views[0])
+        views[1].visible = False
+        views[1].children = []
+        self.assertTrue(compact[1].visible)
+        self.assertEqual(len(compact[1].children), 10)
+
+    def test_compact_nodes_size(self):
+        """
+        Benchmark: the compact format of the nodes must be a lot smaller and
+        faster to unpickle than the nodes themselves.
+        """
+        nodes, compact = self._build_page_like_menu(10000)
+        pickled_nodes = pickle.dumps(nodes, pickle.HIGHEST_PROTOCOL)
+        pickled_compact = pickle.dumps(compact, pickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(pickled_compact) < len(pickled_nodes) * 0.6,
+                        "nodes: %d bytes, compact: %d bytes" % (len(pickled_nodes), len(pickled_compact)))
+        self.assertEqual(len(pickle.loads(pickled_compact)), len(nodes))
+
+        def load(data):
+            # the fastest of several runs is the least disturbed by other load
+            durations = []
+            for i in range(5):
+                start = time.time()
+                pickle.loads(data)
+                durations.append(time.time() - start)
+            return min(durations)
+
+        nodes_duration = load(pickled_nodes)
+        compact_duration = load(pickled_compact)
+        self.assertTrue(compact_duration * 2 < nodes_duration,
+                        "nodes: %.4fs, compact: %.4fs" % (nodes_duration, compact_duration))
+
+    def test_node_views(self):
+        node1 = NavigationNode('1', '/1/', 1)
+        node2 = NavigationNode('2', '/2/', 2, 1)
+        node3 = NavigationNode('3', '/3/', 3, 1)
+        nodes = _build_nodes_inner_for_one_menu([node1, node2, node3], "test")
+        views = get_node_views(nodes)
+        self.assertEqual([view.id for view in views], [1, 2, 3])
+        self.assertTrue(isinstance(views[0], NavigationNode))
+        self.assertEqual(views[0].children, [views[1], views[2]])
+        self.assertEqual(views[1].parent, views[0])
+        self.assertEqual(views[2].get_ancestors(), [views[0]])
+        # modifying the views leaves the shared nodes alone
+        views[0].children.remove(views[1])
+        views[1].parent = None
+        views[1].selected = True
+        self.assertEqual(node1.children, [node2, node3])
+        self.assertEqual(node2.parent, node1)
+        self.assertFalse(hasattr(node2, 'selected'))
+        self.assertEqual(views[1].get_menu_title(), '2')
+
+    def test_mark_selected(self):
+        node1 = NavigationNode('1', '/1/', 1)
+        node2 = NavigationNode('2', '/1/2/', 2, 1)
+        node3 = NavigationNode('3', '/1/2/', 3, 1)
+        node4 = NavigationNode('4', '/1/2/4/', 4, 2)
+        nodes = _build_nodes_inner_for_one_menu([node1, node2, node3, node4], "test")
+        url_index = _get_url_index(nodes)
+        for path, selected in (('/1/2/3/', node2), ('/1/2/4/5/', node4), ('/1/', node1), ('/5/', None)):
+            request = self.get_request(path)
+            views = menu_pool._mark_selected(request, get_node_views(nodes), url_index)
+            self.assertEqual([view.id for view in views if view.selected],
+                             [selected.id] if selected else [])
+            # without an index all nodes are scanned
+            menu_pool._mark_selected(request, nodes)
+            self.assertEqual([node for node in nodes if node.selected],
+                             [selected] if selected else [])
+
+    def test_visiting_modifiers(self):
+        class Hide(Modifier):
+            def visit(self, node):
+                if node.id == 2:
+                    return False
+
+        class Record(Modifier):
+            def start(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+                self.visited = []
+
+            def visit(self, node):
+                self.visited.append(node.id)
+
+        tree, nodes = self._get_nodes()
+        node1, node2, node3, node4, node5 = nodes
+        before, after = Record(), Record()
+        request = self.get_request()
+        result = visit_nodes([before, Hide(), after], request, list(tree), None, None, False, False)
+        # parents before children
+        self.assertEqual(before.visited, [1, 2, 3, 4, 5])
+        # the removed node is not passed on, its children are
+        self.assertEqual(after.visited, [1, 3, 4, 5])
+        self.assertEqual(result, [node1, node3, node4, node5])
+        self.assertEqual(node1.children, [])
+        # modify runs the visitor on its own
+        record = Record()
+        self.assertEqual(record.modify(request, result, None, None, False, False), result)
+        self.assertEqual(record.visited, [1, 5, 3, 4])
+
+    def test_modify_overriding_visitor(self):
+        """
+        A subclass of a visiting modifier which overrides modify gets the
+        whole list, also when the menu pool applies the modifiers
+        """
+        calls = []
+
+        class CustomLevel(Level):
+            def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+                calls.append(len(nodes))
+                return super(CustomLevel, self).modify(request, nodes, namespace, root_id, post_cut, breadcrumb)
+
+        self.assertTrue(is_visitor(Level()))
+        self.assertFalse(is_visitor(CustomLevel()))
+        old_modifiers = menu_pool.modifiers
+        menu_pool.modifiers = [CustomLevel]
+        try:
+            tree, nodes = self._get_nodes()
+        finally:
+            menu_pool.modifiers = old_modifiers
+        self.assertEqual(len(calls), 1)
+        # the levels are still set by the visiting base class
+        self.assertEqual([node.level for node in nodes], [0, 1, 2, 2, 0])
+
     def test_utils_mark_descendants(self):
         tree_nodes, flat_nodes = self._get_nodes()
         mark_descendants(tree_nodes)
@@ -779,14 +1239,12 @@ class ShowSubMenuCheck(SubMenusFixture, BaseMenuTest):
         page = self.get_page(6)
         context = self.get_context(page.get_absolute_url())
         # test standard show_menu
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(3):
             """
             The queries should be:
                 get all pages
                 get all page permissions
                 get all titles
-                get the menu cache key
-                set the menu cache key
             """
             tpl = Template("{% load menu_tags %}{% show_sub_menu %}")
             tpl.render(context)
@@ -846,14 +1304,12 @@ class ShowMenuBelowIdTests(BaseMenuTest):
 
         with LanguageOverride('en'):
             context = self.get_context(a.get_absolute_url())
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(3):
                 """
                 The queries should be:
                     get all pages
                     get all page permissions
                     get all titles
-                    get the menu cache key
-                    set the menu cache key
                 """
                 # Actually seems to run:
                 tpl = Template("{% load menu_tags %}{% show_menu_below_id 'a' 0 100 100 100 %}")
@@ -1106,6 +1562,58 @@ class ViewPermissionMenuTests(SettingsOverrideTestCase):
                 """
                 get_visible_pages(request, pages)
 
+    def test_page_permissions_on_subtrees(self):
+        """
+        Tree:
+            A
+                B
+                    C
+                        D
+                E
+            F
+        """
+        with SettingsOverride(CMS_PUBLIC_FOR='staff'):
+            user = User.objects.create_user('user', 'user@domain.com', 'user')
+            group = Group.objects.create(name='testgroup')
+            group.user_set.add(user)
+            other = User.objects.create_user('other', 'other@domain.com', 'other')
+            pages = {}
+            for title, parent in (('A', None), ('B', 'A'), ('C', 'B'), ('D', 'C'), ('E', 'A'), ('F', None)):
+                pages[title] = create_page(title, 'nav_playground.html', 'en', parent=pages.get(parent))
+            pages = dict((title, Page.objects.get(pk=page.pk)) for title, page in pages.items())
+            PagePermission.objects.create(can_view=True, group=group, page=pages['A'],
+                                          grant_on=ACCESS_CHILDREN)
+            PagePermission.objects.create(can_view=True, user=user, page=pages['C'],
+                                          grant_on=ACCESS_PAGE_AND_DESCENDANTS)
+            PagePermission.objects.create(can_view=True, user=other, page=pages['F'],
+                                          grant_on=ACCESS_DESCENDANTS)
+            restricted = get_restricted_pages()
+            self.assertEqual(sorted(title for title, page in pages.items() if page.pk in restricted),
+                             ['A', 'B', 'C', 'D', 'E', 'F'])
+            self.assertEqual(restricted[pages['A'].pk], [])
+            self.assertEqual(restricted[pages['B'].pk], [(None, group.pk)])
+            self.assertEqual(restricted[pages['C'].pk], [(user.pk, None)])
+            self.assertEqual(restricted[pages['D'].pk], [(user.pk, None)])
+            self.assertEqual(restricted[pages['E'].pk], [(None, group.pk)])
+            self.assertEqual(restricted[pages['F'].pk], [])
+            request = self.get_request(user)
+            with self.assertNumQueries(6):
+                """
+                The queries are:
+                PagePermission query for affected pages
+                Page query for the trees of affected pages
+                GlobalpagePermission query for user
+                Group query for user
+                user permissions
+                group permissions
+                """
+                result = get_visible_pages(request, pages.values())
+            self.assertEqual(sorted(title for title, page in pages.items() if page.pk in result),
+                             ['B', 'C', 'D', 'E'])
+            request = self.get_request(other)
+            result = get_visible_pages(request, pages.values())
+            self.assertEqual(result, [])
+
     def test_global_permission(self):
         with SettingsOverride(CMS_PUBLIC_FOR='staff'):
             user = User.objects.create_user('user', 'user@domain.com', 'user')
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
+from cms.menu import NavExtender
 from cms.models import Page
 from cms.test_utils.fixtures.navextenders import NavextendersFixture
 from cms.test_utils.testcases import SettingsOverrideTestCase
+from cms.test_utils.util.context_managers import SettingsOverride
 from cms.test_utils.util.menu_extender import TestMenu
 from django.conf import settings
 from django.template import Template
-from menus.menu_pool import menu_pool
+from menus.base import get_node_views
+from menus.menu_pool import IndexedNodes, menu_pool
 
 class NavExtenderTestCase(NavextendersFixture, SettingsOverrideTestCase):
 
@@ -83,6 +86,62 @@ class NavExtenderTestCase(NavextendersFixture, SettingsOverrideTestCase):
         self.assertEqual(len(nodes[0].children), 4)
         self.assertEqual(nodes[0].children[1].get_absolute_url(), "/" )
         
+    def test_extenders_with_changed_nodes(self):
+        self._update_page(4, navigation_extenders="TestMenu")
+        menu_pool.clear(settings.SITE_ID)
+        request = self.get_request('/')
+        built, url_index, namespace_index, tree_index = menu_pool._build_nodes(request, settings.SITE_ID)
+        self.assertEqual(len(namespace_index['TestMenu'][0]), 3)
+        self.assertEqual(len(namespace_index['TestMenu'][1]), 4)
+        def swap(nodes):
+            nodes[0], nodes[1] = nodes[1], nodes[0]
+        changes = (None, lambda nodes: nodes.__delitem__(0), lambda nodes: nodes.reverse(), swap)
+        for change in changes:
+            nodes = IndexedNodes(get_node_views(built), namespace_index)
+            if change:
+                # the positions in the index don't apply anymore, also when
+                # the number of nodes stays the same
+                change(nodes)
+                self.assertEqual(nodes.get_namespace_index(), None)
+            else:
+                self.assertTrue(nodes.get_namespace_index() is namespace_index)
+            nodes = NavExtender().modify(request, nodes, None, None, False, False)
+            page4 = [node for node in nodes if node.title == 'page4'][0]
+            self.assertEqual(len(page4.children), 4)
+            self.assertEqual(len([node for node in nodes if node.namespace == 'TestMenu']), 4)
+        self._update_page(4, navigation_extenders=None)
+        menu_pool.clear(settings.SITE_ID)
+        nodes = menu_pool.get_nodes(request)
+        self.assertEqual([node for node in nodes if node.namespace == 'TestMenu'], [])
+
+    def test_show_menu_on_extender_node(self):
+        self._update_page(1, navigation_extenders="TestMenu")
+        menu_pool.clear(settings.SITE_ID)
+        # the selected node is attached below page1 by NavExtender
+        context = self.get_context('/hello/world/')
+        tpl = Template("{% load menu_tags %}{% show_menu 0 100 0 100 %}")
+        with SettingsOverride(CMS_MENU_BOUNDED_NODES=True):
+            tpl.render(context)
+        nodes = context['children']
+        self.assertEqual(len(nodes), 2)
+        self.assertTrue(nodes[0].ancestor)
+        self.assertEqual(len(nodes[0].children), 4)
+        self.assertEqual(nodes[0].children[3].get_absolute_url(), "/hello/")
+        self.assertTrue(nodes[0].children[3].ancestor)
+        self.assertTrue(nodes[0].children[3].children[0].selected)
+        # inactive pages are cut
+        self.assertEqual(len(nodes[1].children), 0)
+
+    def test_show_breadcrumb_on_extender_node(self):
+        self._update_page(4, navigation_extenders="TestMenu")
+        menu_pool.clear(settings.SITE_ID)
+        context = self.get_context('/hello/world/')
+        tpl = Template("{% load menu_tags %}{% show_breadcrumb %}")
+        with SettingsOverride(CMS_MENU_BOUNDED_NODES=True):
+            tpl.render(context)
+        self.assertEqual([node.get_menu_title() for node in context['ancestors']],
+                         ['page1', 'page4', 'sample account page', 'sample my profile page'])
+
     def test_incorrect_nav_extender_in_db(self):
         self._update_page(2, navigation_extenders="SomethingWrong")
         menu_pool.clear(settings.SITE_ID)
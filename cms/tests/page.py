@@ -30,7 +30,8 @@ from cms.test_utils.util.context_managers import (LanguageOverride,
                                                   SettingsOverride,
                                                   UserLoginContext)
 from cms.utils import get_cms_setting
-from cms.utils.page_resolver import get_page_from_request, is_valid_url
+from cms.utils.page_resolver import (get_page_from_path, get_page_from_request, is_valid_url,
+    is_unknown_request_path, set_unknown_request_path)
 from cms.utils.page import is_valid_page_slug
 
 class PagesTestCase(CMSTestCase):
@@ -772,7 +773,8 @@ class PagesTestCase(CMSTestCase):
             # trigger the get_languages query so it doesn't get in our way
             context = self.get_context()
             context['request'].current_page.get_languages()
-            with self.assertNumQueries(4):
+            # the placeholders and the plugins, downcast in the same query
+            with self.assertNumQueries(2):
                 for i, placeholder in enumerate(placeholders):
                     content = get_placeholder_content(context, context['request'], page, placeholder.slot, False)
                     for j in range(5):
@@ -961,3 +963,89 @@ class PageTreeTests(CMSTestCase):
 
         self.assertEqual(child.get_absolute_url(language='en'), '/en/parent/child/')
         self.assertEqual(child.publisher_public.get_absolute_url(language='en'), '/en/parent/child/')
+
+
+class PageRoutingIndexTests(CMSTestCase):
+
+    def test_resolve_without_queries(self):
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        page = create_page('page', 'nav_playground.html', 'en', published=True, parent=home)
+        found = get_page_from_path('page')
+        self.assertEqual(found.pk, page.publisher_public_id)
+        get_page_from_path('')
+        with self.assertNumQueries(0):
+            found = get_page_from_path('page')
+            self.assertEqual(found.pk, page.publisher_public_id)
+            self.assertEqual(get_page_from_path('').pk, home.publisher_public_id)
+            self.assertEqual(get_page_from_path('does-not-exist'), None)
+
+    def test_resolved_pages_are_not_shared(self):
+        create_page('home', 'nav_playground.html', 'en', published=True)
+        page1 = get_page_from_path('')
+        page1.title_cache = {}
+        page2 = get_page_from_path('')
+        self.assertEqual(page1.pk, page2.pk)
+        self.assertFalse(page1 is page2)
+        self.assertFalse(hasattr(page2, 'title_cache'))
+
+    def test_title_change_invalidates(self):
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        page = create_page('page', 'nav_playground.html', 'en', published=True, parent=home)
+        self.assertTrue(get_page_from_path('page'))
+        title = page.get_title_obj('en')
+        title.slug = 'renamed'
+        title.save()
+        page.publish()
+        self.assertEqual(get_page_from_path('page'), None)
+        self.assertEqual(get_page_from_path('renamed').pk, page.publisher_public_id)
+
+    def test_unpublish_invalidates(self):
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        page = create_page('page', 'nav_playground.html', 'en', published=True, parent=home)
+        self.assertTrue(get_page_from_path('page'))
+        page.unpublish()
+        self.assertEqual(get_page_from_path('page'), None)
+        self.assertTrue(get_page_from_path('page', preview=True))
+
+    def test_draft_index(self):
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        create_page('page', 'nav_playground.html', 'en', parent=home)
+        self.assertEqual(get_page_from_path('page'), None)
+        found = get_page_from_path('page', draft=True)
+        self.assertTrue(found.publisher_is_draft)
+        self.assertTrue(get_page_from_path('', draft=True).publisher_is_draft)
+
+    def test_publication_end_date(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        create_page('page', 'nav_playground.html', 'en', published=True, parent=home,
+                    publication_end_date=yesterday)
+        with SettingsOverride(CMS_SHOW_END_DATE=True):
+            self.assertEqual(get_page_from_path('page'), None)
+        with SettingsOverride(CMS_SHOW_END_DATE=False):
+            self.assertTrue(get_page_from_path('page'))
+
+    def test_unknown_path_cached(self):
+        home = create_page('home', 'nav_playground.html', 'en', published=True)
+        response = self.client.get('/en/unknown/')
+        self.assertEqual(response.status_code, 404)
+        request = self.get_request('/en/unknown/')
+        self.assertTrue(is_unknown_request_path(request))
+        with self.assertNumQueries(0):
+            self.assertEqual(request.current_page, None)
+        # creating the page invalidates the cached 404
+        create_page('unknown', 'nav_playground.html', 'en', published=True, parent=home)
+        self.assertFalse(is_unknown_request_path(request))
+        response = self.client.get('/en/unknown/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_path_cache_bounded(self):
+        create_page('home', 'nav_playground.html', 'en', published=True)
+        with SettingsOverride(CMS_UNKNOWN_PATHS_CACHE_SIZE=2):
+            for path in ('/en/a/', '/en/b/', '/en/c/'):
+                set_unknown_request_path(self.get_request(path))
+            self.assertFalse(is_unknown_request_path(self.get_request('/en/a/')))
+            self.assertTrue(is_unknown_request_path(self.get_request('/en/b/')))
+            self.assertTrue(is_unknown_request_path(self.get_request('/en/c/')))
+        with SettingsOverride(CMS_UNKNOWN_PATHS_CACHE_SIZE=0):
+            self.assertFalse(is_unknown_request_path(self.get_request('/en/c/')))
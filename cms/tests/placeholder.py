@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
+import os
 from django.utils.numberformat import format
 from cms import constants
 from cms.api import add_plugin, create_page
 from cms.exceptions import DuplicatePlaceholderWarning
 from cms.models.fields import PlaceholderField
 from cms.models.placeholdermodel import Placeholder
+from cms.models.pluginmodel import CMSPlugin
 from cms.plugin_pool import plugin_pool
 from cms.plugin_rendering import render_placeholder
 from cms.plugins.link.cms_plugins import LinkPlugin
@@ -23,8 +25,9 @@ from cms.utils.placeholder import PlaceholderNoAction, MLNGPlaceholderActions
 from cms.utils.plugins import get_placeholders
 from django.conf import settings
 from django.contrib import admin
-from django.contrib.auth.models import User, Permission
+from django.contrib.auth.models import AnonymousUser, User, Permission
 from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseForbidden, HttpResponse
 from django.template import TemplateSyntaxError, Template
@@ -245,6 +248,60 @@ class PlaceholderTestCase(CMSTestCase):
         rctx['placeholder'] = placeholder
         self.assertEqual(template.render(rctx).strip(), "test")
 
+    def test_placeholder_cache(self):
+        from cms.test_utils import project
+
+        cache.clear()
+        template_dir = os.path.join(os.path.dirname(project.__file__), 'templates', 'alt_plugin_templates',
+                                    'show_placeholder')
+        template = Template(
+            "{% load placeholder_tags sekizai_tags %}{% render_placeholder placeholder %}{% render_block 'js' %}")
+        placeholder = Placeholder.objects.create(slot="test")
+        plugin = add_plugin(placeholder, "TextPlugin", "en", body="first")
+        other = Placeholder.objects.create(slot="other")
+        plugin_cache_data = {'default': {'cacheable': True, 'vary_user': False}}
+
+        def render(user=None):
+            request = self.get_request('/')
+            if user is not None:
+                request.user = user
+            rctx = RequestContext(request)
+            rctx['placeholder'] = Placeholder.objects.get(pk=placeholder.pk)
+            return template.render(rctx)
+
+        with SettingsOverride(TEMPLATE_DIRS=[template_dir], CMS_PLACEHOLDER_CACHE=True,
+                              CMS_PLUGIN_CACHE_DATA=plugin_cache_data):
+            self.assertIn('JAVASCRIPT', render())
+            with self.assertNumQueries(1):
+                # only the placeholder is fetched
+                output = render()
+            # the sekizai data is restored
+            self.assertIn('JAVASCRIPT', output)
+        with SettingsOverride(CMS_PLACEHOLDER_CACHE=True, CMS_PLUGIN_CACHE_DATA=plugin_cache_data):
+            # changing a plugin invalidates the placeholder
+            text = Text.objects.get(pk=plugin.pk)
+            text.body = "second"
+            text.save()
+            self.assertIn('second', render())
+            # so does moving it to another placeholder
+            plugin = CMSPlugin.objects.get(pk=plugin.pk)
+            plugin.placeholder = other
+            plugin.save()
+            self.assertNotIn('second', render())
+            # plugins varying per user
+            add_plugin(placeholder, "TextPlugin", "en", body="third")
+            plugin_cache_data['default']['vary_user'] = True
+            self.assertIn('third', render())
+            with self.assertNumQueries(1):
+                render()
+            self.assertIn('third', render(AnonymousUser()))
+            # placeholders with uncacheable plugins are always rendered
+            plugin_cache_data['default']['cacheable'] = False
+            cache.clear()
+            render()
+            Text.objects.filter(body="third").update(body="fourth")
+            self.assertIn('fourth', render())
+
     def test_placeholder_tag_language(self):
         template = Template("{% load placeholder_tags %}{% render_placeholder placeholder language language %}")
         placeholder = Placeholder.objects.create(slot="test")
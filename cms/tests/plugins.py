@@ -3,12 +3,15 @@ from __future__ import with_statement
 import datetime
 
 from cms.api import create_page, publish_page, add_plugin
+from cms.cache import plugin as plugin_cache_module
+from cms.cache.plugin import plugin_cache_stats
 from cms.exceptions import PluginAlreadyRegistered, PluginNotRegistered
 from cms.models import Page, Placeholder
 from cms.models.pluginmodel import CMSPlugin, PluginModelBase
 from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
-from cms.plugins.utils import get_plugins_for_page
+from cms.plugin_rendering import render_plugins
+from cms.plugins.utils import downcast_plugins, get_plugins, get_plugins_for_page
 from cms.plugins.file.models import File
 from cms.plugins.inherit.models import InheritPagePlaceholder
 from cms.plugins.link.forms import LinkForm
@@ -20,6 +23,8 @@ from cms.plugins.twitter.models import TwitterRecentEntries
 from cms.test_utils.project.pluginapp.models import Article, Section
 from cms.test_utils.project.pluginapp.plugins.manytomany_rel.models import (
     ArticlePluginModel)
+from cms.test_utils.project.pluginapp.plugins.multi_level.models import (
+    ChildPluginModel, ParentPluginModel)
 from cms.test_utils.testcases import CMSTestCase, URL_CMS_PAGE, URL_CMS_PLUGIN_MOVE, \
     URL_CMS_PAGE_ADD, URL_CMS_PLUGIN_ADD, URL_CMS_PLUGIN_EDIT, URL_CMS_PAGE_CHANGE, URL_CMS_PLUGIN_REMOVE, \
     URL_CMS_PLUGIN_HISTORY_EDIT
@@ -29,13 +34,18 @@ from cms.utils.copy_plugins import copy_plugins_to
 from django.utils import timezone
 from django.conf import settings
 from django.contrib import admin
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.forms.widgets import Media
+from django.template import RequestContext
+from django.test.client import RequestFactory
 from django.test.testcases import TestCase
 import os
+import warnings
 
 
 class DumbFixturePlugin(CMSPluginBase):
@@ -548,20 +558,224 @@ class PluginsTestCase(PluginsTestBaseCase):
         text_plugin.save()
         txt = text_plugin.text
         ph = Placeholder.objects.get(pk=ph.pk)
-        with self.assertNumQueries(2):
-            # 1 query for the CMSPlugin objects,
-            # 1 query for each type of child object (1 in this case, all are Link plugins)
+        with self.assertNumQueries(1):
+            # the CMSPlugin objects are fetched along with the rows of their
+            # plugin models
             txt.body = plugin_tags_to_admin_html(
                 '\n'.join(["{{ plugin_object %d }}" % l.cmsplugin_ptr_id
                     for l in link_plugins]))
         txt.save()
         text_plugin = self.reload(text_plugin)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             rendered = text_plugin.render_plugin(placeholder=ph)
         for i in range(0, 10):
             self.assertTrue('A Link %d' % i in rendered)
 
+    def test_plugin_cache(self):
+        from cms.plugins.text.cms_plugins import TextPlugin
+
+        cache.clear()
+        plugin_cache_stats.reset()
+        ph = Placeholder.objects.create(slot="test")
+        text_plugin = add_plugin(ph, "TextPlugin", "en", body="first")
+
+        def render(path='/', method='get'):
+            request = getattr(RequestFactory(), method)(path)
+            request.user = self.super_user
+            context = RequestContext(request)
+            return CMSPlugin.objects.get(pk=text_plugin.pk).render_plugin(context, ph)
+
+        try:
+            TextPlugin.cache_vary = ()
+            self.assertEqual(render('/a/'), 'first')
+            Text.objects.filter(pk=text_plugin.pk).update(body="second")
+            # the output is shared between paths
+            self.assertEqual(render('/b/'), 'first')
+            self.assertEqual(plugin_cache_stats.get_counts('TextPlugin'), (1, 1))
+            # but not between requests which might change something
+            self.assertEqual(render('/b/', 'post'), 'second')
+            TextPlugin.cache_vary = ('path', 'query')
+            self.assertEqual(render('/a/'), 'second')
+            Text.objects.filter(pk=text_plugin.pk).update(body="third")
+            self.assertEqual(render('/a/'), 'second')
+            self.assertEqual(render('/b/'), 'third')
+            self.assertEqual(render('/a/?page=2'), 'third')
+            # saving a plugin of the placeholder invalidates the output
+            add_plugin(ph, "TextPlugin", "en", body="other")
+            self.assertEqual(render('/a/'), 'third')
+            self.assertEqual(plugin_cache_stats.get_counts(), (2, 5))
+            self.assertEqual(plugin_cache_stats.get_hit_rate('TextPlugin'), 2.0 / 7)
+            self.assertEqual(plugin_cache_stats.get_hit_rate('LinkPlugin'), None)
+        finally:
+            TextPlugin.cache_vary = None
+            plugin_cache_stats.reset()
+
+    def test_legacy_plugin_cache(self):
+        cache.clear()
+        ph = Placeholder.objects.create(slot="test")
+        text_plugin = add_plugin(ph, "TextPlugin", "en", body="first")
+
+        def render(path, user=None, csrf_token=None):
+            request = RequestFactory().get(path)
+            request.user = user or self.super_user
+            if csrf_token:
+                request.META['CSRF_COOKIE'] = csrf_token
+            context = RequestContext(request)
+            return CMSPlugin.objects.get(pk=text_plugin.pk).render_plugin(context, ph)
+
+        plugin_cache_module.LEGACY_CACHE_DATA_WARNED = False
+        with SettingsOverride(CMS_PLUGIN_CACHE_DATA={'default': {'cacheable': True}}):
+            with warnings.catch_warnings(record=True) as warned:
+                warnings.simplefilter('always')
+                self.assertEqual(render('/a/'), 'first')
+                Text.objects.filter(pk=text_plugin.pk).update(body="second")
+                self.assertEqual(render('/a/'), 'first')
+                # requests with parameters don't share the output
+                self.assertEqual(render('/a/?page=2'), 'second')
+                # anonymous visitors are told apart by their CSRF token
+                self.assertEqual(render('/a/', AnonymousUser(), 'a' * 32), 'second')
+                Text.objects.filter(pk=text_plugin.pk).update(body="third")
+                self.assertEqual(render('/a/', AnonymousUser(), 'a' * 32), 'second')
+                self.assertEqual(render('/a/', AnonymousUser(), 'b' * 32), 'third')
+            # the deprecation is only warned about once
+            self.assertEqual([warning.category for warning in warned], [DeprecationWarning])
+
+    def test_render_plugins_batches_cache(self):
+        from cms.plugins.text.cms_plugins import TextPlugin
+
+        cache.clear()
+        ph = Placeholder.objects.create(slot="test")
+        for i in range(5):
+            add_plugin(ph, "TextPlugin", "en", body="text %d" % i)
+        calls = []
+        nested = []
+
+        def count(name):
+            method = getattr(cache, name)
+
+            def counted(*args, **kwargs):
+                # the local memory backend implements get_many with get
+                if not nested:
+                    calls.append(name)
+                nested.append(name)
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    nested.pop()
+            return counted
+
+        def render():
+            request = RequestFactory().get('/')
+            request.user = self.super_user
+            request.current_page = None
+            del calls[:]
+            for name in ('get', 'get_many', 'set', 'set_many'):
+                setattr(cache, name, count(name))
+            try:
+                return render_plugins(get_plugins(request, Placeholder.objects.get(pk=ph.pk), 'en'),
+                                      RequestContext(request), ph)
+            finally:
+                for name in ('get', 'get_many', 'set', 'set_many'):
+                    delattr(cache, name)
+
+        try:
+            TextPlugin.cache_vary = ('language',)
+            first = render()
+            # the placeholder generation and the output of the text plugins
+            self.assertEqual(sorted(calls), ['get_many', 'get_many', 'set_many'])
+            self.assertEqual(render(), first)
+            self.assertEqual(sorted(calls), ['get_many', 'get_many'])
+            self.assertEqual(len(first), 5)
+            self.assertIn('text 4', first[4])
+        finally:
+            TextPlugin.cache_vary = None
+
+    def test_plugin_cache_vary_user(self):
+        from cms.plugins.text.cms_plugins import TextPlugin
+
+        cache.clear()
+        ph = Placeholder.objects.create(slot="test")
+        text_plugin = add_plugin(ph, "TextPlugin", "en", body="first")
+        group = Group.objects.create(name="group")
+        self.slave.groups.add(group)
+
+        def render(user):
+            request = RequestFactory().get('/')
+            request.user = user
+            return CMSPlugin.objects.get(pk=text_plugin.pk).render_plugin(RequestContext(request), ph)
+
+        try:
+            for vary, shared in ((('user',), False), (('groups',), True)):
+                TextPlugin.cache_vary = vary
+                Text.objects.filter(pk=text_plugin.pk).update(body=vary[0])
+                self.assertEqual(render(self.super_user), vary[0])
+                Text.objects.filter(pk=text_plugin.pk).update(body="changed")
+                self.assertEqual(render(self.super_user), vary[0])
+                self.assertEqual(render(AnonymousUser()), vary[0] if shared else "changed")
+                self.assertEqual(render(self.slave), "changed")
+        finally:
+            TextPlugin.cache_vary = None
+
+    def test_downcast_plugins(self):
+        ph = Placeholder.objects.create(slot="test")
+        text = add_plugin(ph, "TextPlugin", "en", body="text")
+        link = add_plugin(ph, "LinkPlugin", "en", name="link", url="http://example.com")
+        picture = add_plugin(ph, "PicturePlugin", "en", image="picture.png")
+        orphan = add_plugin(ph, "TextPlugin", "en", body="orphan")
+        # a base row whose plugin model row is gone
+        Text.objects.filter(pk=orphan.pk).delete()
+        queryset = CMSPlugin.objects.filter(placeholder=ph).order_by('position')
+        with self.assertNumQueries(1):
+            plugins = downcast_plugins(queryset, select_placeholder=True)
+            self.assertEqual([plugin.pk for plugin in plugins], [text.pk, link.pk, picture.pk])
+            self.assertEqual([plugin.__class__ for plugin in plugins], [Text, Link, Picture])
+            self.assertEqual(plugins[0].body, "text")
+            self.assertEqual(plugins[1].url, "http://example.com")
+            self.assertEqual(plugins[2].placeholder, ph)
+            self.assertEqual(plugins[2].plugin_type, "PicturePlugin")
+        # evaluated querysets cost one more query
+        base_plugins = list(queryset)
+        with self.assertNumQueries(1):
+            plugins = downcast_plugins(base_plugins)
+            self.assertEqual([plugin.body for plugin in plugins[:1]], ["text"])
+            self.assertEqual(len(plugins), 3)
+
+    def test_downcast_multi_level_plugins(self):
+        class ParentPlugin(CMSPluginBase):
+            model = ParentPluginModel
+            render_plugin = False
+
+        class ChildPlugin(CMSPluginBase):
+            model = ChildPluginModel
+            render_plugin = False
+
+        plugin_pool.register_plugin(ParentPlugin)
+        plugin_pool.register_plugin(ChildPlugin)
+        try:
+            ph = Placeholder.objects.create(slot="test")
+            text = add_plugin(ph, "TextPlugin", "en", body="text")
+            parent = add_plugin(ph, "ParentPlugin", "en", title="parent")
+            child = add_plugin(ph, "ChildPlugin", "en", title="child", subtitle="subtitle")
+            queryset = CMSPlugin.objects.filter(placeholder=ph).order_by('position')
+            # the rows of ChildPluginModel are fetched separately
+            with self.assertNumQueries(2):
+                plugins = downcast_plugins(queryset)
+                self.assertEqual([plugin.__class__ for plugin in plugins],
+                                 [Text, ParentPluginModel, ChildPluginModel])
+                self.assertEqual(plugins[1].title, "parent")
+                self.assertEqual(plugins[2].pk, child.pk)
+                self.assertEqual(plugins[2].title, "child")
+                self.assertEqual(plugins[2].subtitle, "subtitle")
+            base_plugins = list(queryset)
+            with self.assertNumQueries(2):
+                plugins = downcast_plugins(base_plugins)
+                self.assertEqual([plugin.pk for plugin in plugins], [text.pk, parent.pk, child.pk])
+                self.assertEqual(plugins[2].subtitle, "subtitle")
+        finally:
+            plugin_pool.unregister_plugin(ParentPlugin)
+            plugin_pool.unregister_plugin(ChildPlugin)
+
     def test_copy_textplugin(self):
         """
         Test that copying of textplugins replaces references to copied plugins
@@ -1099,6 +1313,18 @@ class SimplePluginTests(TestCase):
 
         self.assertEqual(MyPlugin.name, 'My Plugin')
 
+    def test_cache_vary_validation(self):
+        def declare(vary):
+            class MyPlugin(CMSPluginBase):
+                render_template = 'base.html'
+                cache_vary = vary
+            return MyPlugin
+
+        self.assertEqual(declare(('page', 'language')).cache_vary, ('page', 'language'))
+        self.assertEqual(declare(()).cache_vary, ())
+        self.assertRaises(ImproperlyConfigured, declare, ('page', 'weather'))
+        self.assertRaises(ImproperlyConfigured, declare, 'page')
+
     def test_simple_context(self):
         class MyPlugin(CMSPluginBase):
             render_template = 'base.html'
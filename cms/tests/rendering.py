@@ -2,10 +2,12 @@
 from __future__ import with_statement
 from cms import plugin_rendering
 from cms.api import create_page, add_plugin
+from cms.models import Page
 from cms.models.placeholdermodel import Placeholder
 from cms.models.pluginmodel import CMSPlugin
 from cms.plugin_rendering import (render_plugins, PluginContext, 
     render_placeholder_toolbar)
+from cms.templatetags.cms_tags import get_placeholder_content
 from cms.test_utils.testcases import SettingsOverrideTestCase
 from cms.test_utils.util.context_managers import SettingsOverride, ChangeModel
 from cms.test_utils.util.mock import AttributeObject
@@ -168,6 +170,33 @@ class RenderingTestCase(SettingsOverrideTestCase):
             r = "".join(c) 
             self.assertEqual(r, u'1|'+self.test_data['text_main']+'|test_passed_plugin_context_processor_ok|test_plugin_context_processor_ok|'+self.test_data['text_main']+'|main|test_plugin_processor_ok|'+self.test_data['text_main']+'|main|original_context_var_ok')
             plugin_rendering._standard_processors = {}
+
+    def test_processor_chains_loaded_once(self):
+        """
+        Tests that the processors are only imported once and loaded again when
+        the settings change.
+        """
+        instance, plugin = CMSPlugin.objects.all()[0].get_plugin_instance()
+        instance.render_template = Template(u'{{ test_plugin_context_processor }}')
+        placeholder = self.test_placeholders['main']
+        with SettingsOverride(
+                CMS_PLUGIN_PROCESSORS = ('cms.tests.rendering.sample_plugin_processor',),
+                CMS_PLUGIN_CONTEXT_PROCESSORS = ('cms.tests.rendering.sample_plugin_context_processor',),
+            ):
+            context = PluginContext({'original_context_var': 'ok'}, instance, placeholder)
+            "".join(render_plugins((instance,), context, placeholder))
+            iterload_objects = plugin_rendering.iterload_objects
+            plugin_rendering.iterload_objects = None
+            try:
+                context = PluginContext({'original_context_var': 'ok'}, instance, placeholder)
+                r = "".join(render_plugins((instance,), context, placeholder))
+            finally:
+                plugin_rendering.iterload_objects = iterload_objects
+            self.assertTrue(r.startswith(u'test_plugin_context_processor_ok|'))
+            self.assertIn(u'|test_plugin_processor_ok|', r)
+        context = PluginContext({}, instance, placeholder)
+        r = "".join(render_plugins((instance,), context, placeholder))
+        self.assertEqual(r, u'')
     
     def test_placeholder(self):
         """
@@ -293,6 +322,51 @@ class RenderingTestCase(SettingsOverrideTestCase):
         r = self.render(t, self.test_page3)
         self.assertEqual(r, u'|'+self.test_data['text_main']+'|'+self.test_data3['text_sub'])
 
+    def test_inherit_placeholder_queries(self):
+        """
+        Tests that the placeholders of all ancestors are fetched at once, and
+        only if needed.
+        """
+        page = self.test_page3
+        with SettingsOverride(CMS_TEMPLATES=[(TEMPLATE_NAME, '')]):
+            context = self.get_context(page)
+            page.get_cached_ancestors(ascending=True)
+            get_placeholder_content(context, context['request'], page, 'sub', False)
+            with self.assertNumQueries(2):
+                r = get_placeholder_content(context, context['request'], page, 'main', True)
+            self.assertEqual(self.strip_rendered(r), self.test_data['text_main'])
+            with self.assertNumQueries(0):
+                get_placeholder_content(context, context['request'], page, 'main', True)
+            # the ancestors aren't needed if the page has content of its own
+            page = Page.objects.get(pk=self.test_page3.pk)
+            context = self.get_context(page)
+            with self.assertNumQueries(2):
+                """
+                The queries are:
+                    the placeholders of the page
+                    their plugins
+                """
+                r = get_placeholder_content(context, context['request'], page, 'sub', True)
+            self.assertEqual(self.strip_rendered(r), self.test_data3['text_sub'])
+
+    def test_placeholder_cache_skips_plugins(self):
+        """
+        Tests that the plugins are not fetched if the placeholder is cached.
+        """
+        plugin_cache_data = {'default': {'cacheable': True, 'vary_user': False}}
+        with SettingsOverride(CMS_TEMPLATES=[(TEMPLATE_NAME, '')], CMS_PLACEHOLDER_CACHE=True,
+                              CMS_PLUGIN_CACHE_DATA=plugin_cache_data):
+            page = Page.objects.get(pk=self.test_page.pk)
+            context = self.get_context(page)
+            r = get_placeholder_content(context, context['request'], page, 'main', False)
+            self.assertEqual(self.strip_rendered(r), self.test_data['text_main'])
+            page = Page.objects.get(pk=self.test_page.pk)
+            context = self.get_context(page)
+            with self.assertNumQueries(1):
+                # only the placeholders of the page are fetched
+                r = get_placeholder_content(context, context['request'], page, 'main', False)
+            self.assertEqual(self.strip_rendered(r), self.test_data['text_main'])
+
     def test_extra_context_isolation(self):
         with ChangeModel(self.test_page, template='extra_context.html'):
             response = self.client.get(self.test_page.get_absolute_url())
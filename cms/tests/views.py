@@ -1,19 +1,27 @@
 from __future__ import with_statement
 import re
 
-from cms.api import create_page, create_title
+from cms.api import create_page, create_title, add_plugin
 from cms.apphook_pool import apphook_pool
-from cms.models import PagePermission
+from cms import views
+from cms.cache.page import (get_cache_version, get_last_change_key, get_page_cache_key,
+    invalidate_page_cache)
+from cms.cache.page_resolver import clear_page_resolver_cache
+from cms.models import Page, PagePermission, Title
 from cms.test_utils.testcases import SettingsOverrideTestCase
 from cms.test_utils.util.context_managers import SettingsOverride
 from cms.views import _handle_no_page, details
 from cms.utils.i18n import force_language
 
 from django.contrib.auth.models import Permission
+from django.core.cache import cache
 from django.conf import settings
 from django.core.urlresolvers import clear_url_caches
 from django.http import Http404, HttpResponse
+from django.utils import timezone
+import datetime
 import sys
+import time
 
 
 APP_NAME = 'SampleApp'
@@ -168,3 +176,114 @@ class ViewTests(SettingsOverrideTestCase):
         PagePermission.objects.create(can_change=True, user=user, page=page)
         response = self.client.get("/en/?edit")
         self.assertContains(response, "'edit_mode': true,", 1, 200)
+
+    def test_page_cache(self):
+        page = create_page("page", "nav_playground.html", "en", published=True)
+        placeholder = page.placeholders.get(slot='body')
+        add_plugin(placeholder, "TextPlugin", "en", body="first")
+        page.publish()
+        with SettingsOverride(CMS_PAGE_CACHE=True):
+            response = self.client.get('/en/')
+            self.assertContains(response, "first")
+            with self.assertNumQueries(0):
+                cached = self.client.get('/en/')
+            self.assertEqual(cached.content, response.content)
+            # changes that don't fire signals are not visible
+            Title.objects.filter(page=page.publisher_public).update(title="changed")
+            self.assertNotContains(self.client.get('/en/'), "changed")
+            # saving a plugin invalidates the cache
+            add_plugin(placeholder, "TextPlugin", "en", body="second")
+            response = self.client.get('/en/')
+            self.assertContains(response, "changed")
+
+    def test_page_cache_templates(self):
+        page = create_page("page", "nav_playground.html", "en", published=True)
+        with SettingsOverride(CMS_PAGE_CACHE=['col_two.html']):
+            self.assertEqual(self.client.get('/en/').status_code, 200)
+            Title.objects.filter(page=page.publisher_public).update(title="changed")
+            self.assertContains(self.client.get('/en/'), "changed")
+
+    def test_page_cache_authenticated(self):
+        page = create_page("page", "nav_playground.html", "en", published=True)
+        user = self.get_superuser()
+        self.client.login(username=user.username, password=user.username)
+        with SettingsOverride(CMS_PAGE_CACHE=True):
+            self.assertEqual(self.client.get('/en/').status_code, 200)
+            Title.objects.filter(page=page.publisher_public).update(title="changed")
+            self.assertContains(self.client.get('/en/'), "changed")
+
+    def test_conditional_get(self):
+        page = create_page("page", "nav_playground.html", "en", published=True)
+        # off by default
+        self.assertFalse(self.client.get('/en/').has_header('ETag'))
+        with SettingsOverride(CMS_PAGE_CACHE=True, CMS_PAGE_CONDITIONAL_GET=True):
+            response = self.client.get('/en/')
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            # not served from the page cache
+            cache.delete(get_page_cache_key(self.get_request('/en/'), settings.SITE_ID, 'en'),
+                         version=get_cache_version())
+            response = self.client.get('/en/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            # publishing invalidates the validators
+            page.publish()
+            response = self.client.get('/en/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_last_modified(self):
+        page = create_page("page", "nav_playground.html", "en", published=True)
+        with SettingsOverride(CMS_PAGE_CACHE=True, CMS_PAGE_CONDITIONAL_GET=True):
+            # changed within the current second
+            cache.set(get_last_change_key(), int(time.time()) + 1)
+            response = self.client.get('/en/')
+            self.assertFalse(response.has_header('Last-Modified'))
+            past = timezone.now() - datetime.timedelta(minutes=1)
+            Page.objects.filter(pk=page.publisher_public_id).update(changed_date=past)
+            invalidate_page_cache()
+            cache.set(get_last_change_key(), int(time.time()) - 60)
+            clear_page_resolver_cache()
+            last_modified = self.client.get('/en/')['Last-Modified']
+            response = self.client.get('/en/', HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+            page.publish()
+            response = self.client.get('/en/', HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_page_cache(self):
+        create_page("page", "nav_playground.html", "en", published=True)
+        with SettingsOverride(CMS_PAGE_CACHE=True, CMS_PAGE_CONDITIONAL_GET=True):
+            etag = self.client.get('/en/')['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get('/en/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        cache.clear()
+        with SettingsOverride(CMS_PAGE_CACHE=['col_two.html'], CMS_PAGE_CONDITIONAL_GET=True):
+            # only pages which may be cached are validated
+            self.assertFalse(self.client.get('/en/').has_header('ETag'))
+
+    def test_conditional_get_csrf(self):
+        create_page("page", "nav_playground.html", "en", published=True)
+        with SettingsOverride(CMS_PAGE_CACHE=True, CMS_PAGE_CONDITIONAL_GET=True):
+            original_render = views.render_to_response
+
+            def render_to_response(*args, **kwargs):
+                # a plugin rendering a form
+                unicode(kwargs['context_instance'].get('csrf_token'))
+                return original_render(*args, **kwargs)
+            views.render_to_response = render_to_response
+            try:
+                response = self.client.get('/en/')
+            finally:
+                views.render_to_response = original_render
+            self.assertFalse(response.has_header('ETag'))
+
+    def test_conditional_get_authenticated(self):
+        create_page("page", "nav_playground.html", "en", published=True)
+        user = self.get_superuser()
+        self.client.login(username=user.username, password=user.username)
+        with SettingsOverride(CMS_PAGE_CACHE=True, CMS_PAGE_CONDITIONAL_GET=True):
+            response = self.client.get('/en/')
+        self.assertFalse(response.has_header('ETag'))
@@ -58,6 +58,13 @@ DEFAULTS = {
     'UNIHANDECODE_DECODERS': ['ja', 'zh', 'kr', 'vn', 'diacritic'],
     'UNIHANDECODE_DEFAULT_DECODER': 'diacritic',
     'MAX_PAGE_PUBLISH_REVERSIONS': 25,
+    'UNKNOWN_PATHS_CACHE_SIZE': 1000,
+    'PAGE_CACHE': False,
+    'PAGE_CONDITIONAL_GET': False,
+    'PLACEHOLDER_CACHE': False,
+    'MENU_FRAGMENT_CACHE': False,
+    'MENU_WARM_ON_PUBLISH': False,
+    'MENU_BOUNDED_NODES': False,
 }
 
 
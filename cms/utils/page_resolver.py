@@ -8,8 +8,9 @@ from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.utils.encoding import force_unicode
 from django.utils.safestring import mark_safe
-from django.utils.translation import ugettext_lazy as _, ungettext_lazy
+from django.utils.translation import get_language, ugettext_lazy as _, ungettext_lazy
 
+from cms.cache.page_resolver import get_routing_index, is_unknown_path, set_unknown_path
 from cms.exceptions import NoHomeFound
 from cms.models.pagemodel import Page
 from cms.utils.urlutils import any_path_re
@@ -30,6 +31,30 @@ def use_draft(request):
     return (preview_draft or edit_mode) and authenticated
 
 
+def _use_unknown_paths_cache(request):
+    # only public lookups are remembered, drafts change all the time
+    return not use_draft(request) and 'preview' not in request.GET
+
+
+def is_unknown_request_path(request):
+    """
+    Returns True if the path of this request is known to resolve neither to a
+    CMS page nor to an apphooked page.
+    """
+    if not _use_unknown_paths_cache(request):
+        return False
+    return is_unknown_path(Site.objects.get_current().pk, get_language(), request.path)
+
+
+def set_unknown_request_path(request):
+    """
+    Remembers that the path of this request resolves neither to a CMS page
+    nor to an apphooked page, until pages or titles change.
+    """
+    if _use_unknown_paths_cache(request):
+        set_unknown_path(Site.objects.get_current().pk, get_language(), request.path)
+
+
 def get_page_queryset(request=None):
     if request and use_draft(request):
         return Page.objects.drafts()
@@ -43,17 +68,18 @@ def get_fallback_languages_for_page(page, current_language, current_user=None, a
     return [language for language in get_fallback_languages(current_language) if language in allowed_languages]
 
 
+def _is_admin_path(path):
+    if 'django.contrib.admin' in settings.INSTALLED_APPS:
+        return path.startswith(reverse('admin:index'))
+    return False
+
+
 def get_page_queryset_from_path(path, preview=False, draft=False, site=None):
     """ Returns a queryset of pages corresponding to the path given
     In may returns None or a single page is no page is present or root path is given
     """
-    if 'django.contrib.admin' in settings.INSTALLED_APPS:
-        admin_base = reverse('admin:index')
-    else:
-        admin_base = None
-
     # Check if this is called from an admin request
-    if admin_base and path.startswith(admin_base):
+    if _is_admin_path(path):
         # if so, get the page ID to request it directly
         match = ADMIN_PAGE_RE.search(path)
         if not match:
@@ -97,10 +123,38 @@ def get_page_queryset_from_path(path, preview=False, draft=False, site=None):
     return pages.filter(title_set__path=path).distinct()
 
 
+def _get_page_from_index(path, preview=False, draft=False):
+    """
+    Resolves a path using the in-process routing index, without touching the
+    database once the index is built. Returns False if the index can't answer
+    the lookup and the queryset based resolution has to be used.
+    """
+    if _is_admin_path(path):
+        return False
+    site = Site.objects.get_current()
+    index = get_routing_index(site.pk, draft)
+    if index is None:
+        return False
+    page_ids = index.resolve(path, published_only=not (draft or preview))
+    if not page_ids:
+        return None
+    if len(page_ids) > 1:
+        # let the queryset raise MultipleObjectsReturned
+        return False
+    try:
+        return index.get_page(page_ids[0])
+    except Page.DoesNotExist:
+        # the index is stale (e.g. changes that didn't fire signals)
+        return False
+
+
 def get_page_from_path(path, preview=False, draft=False):
     """ Resolves a url path to a single page object.
     Raises exceptions is page does not exist or multiple pages are found
     """
+    page = _get_page_from_index(path, preview, draft)
+    if page is not False:
+        return page
     page_qs = get_page_queryset_from_path(path, preview, draft)
     if page_qs is not None:
         if isinstance(page_qs, Page):
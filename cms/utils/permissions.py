@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import hashlib
+
 from cms.exceptions import NoPermissionsException
 from cms.models import Page, PagePermission, GlobalPagePermission
 from cms.plugin_pool import plugin_pool
@@ -133,6 +135,35 @@ def get_any_page_view_permissions(request, page):
     return PagePermission.objects.for_page(page=page).filter(can_view=True)
 
 
+def get_visibility_fingerprint(request, site_id):
+    """
+    Returns a hash of everything cms.menu.get_visible_pages takes into account
+    for the authenticated user of the request, so users who see the same pages
+    get the same fingerprint. Caches the result on a request basis.
+
+    :param request: the Request object
+    :param site_id: the Site ID
+    :return: a hex digest
+    """
+    from cms.utils.page_resolver import use_draft
+
+    if not hasattr(request, '_cms_visibility_fingerprints'):
+        request._cms_visibility_fingerprints = {}
+    if site_id not in request._cms_visibility_fingerprints:
+        user = request.user
+        user_q = Q(user=user) | Q(group__user=user)
+        global_view_perms = GlobalPagePermission.objects.filter(
+            user_q & Q(can_view=True) & Q(Q(sites__in=[site_id]) | Q(sites__isnull=True))
+        ).exists()
+        page_permission_ids = sorted(set(
+            PagePermission.objects.filter(user_q, can_view=True).values_list('pk', flat=True)))
+        fingerprint = "%d:%d:%d:%d:%s" % (
+            user.is_staff, global_view_perms, user.has_perm('cms.view_page'),
+            use_draft(request), ",".join(str(pk) for pk in page_permission_ids))
+        request._cms_visibility_fingerprints[site_id] = hashlib.md5(fingerprint).hexdigest()
+    return request._cms_visibility_fingerprints[site_id]
+
+
 def get_user_permission_level(user):
     """
     Returns highest user level from the page/permission hierarchy on which
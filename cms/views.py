@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement
 from cms.apphook_pool import apphook_pool
-from cms.appresolver import get_app_urls
+from cms.appresolver import get_app_url_resolver
+from cms.cache.page import (get_page_response, get_page_validators, is_page_cache_enabled,
+    set_page_response)
 from cms.models import Title
-from cms.utils import get_template_from_request, get_language_from_request
+from cms.utils import get_cms_setting, get_template_from_request, get_language_from_request
 from cms.utils.i18n import (
     force_language,
     get_public_languages,
@@ -12,17 +14,19 @@ from cms.utils.i18n import (
     get_redirect_on_fallback,
     is_language_prefix_patterns_used,
 )
-from cms.utils.page_resolver import get_fallback_languages_for_page, get_page_from_request
+from cms.utils.page_resolver import (get_fallback_languages_for_page, get_page_from_request,
+    is_unknown_request_path, set_unknown_request_path)
 from cms.test_utils.util.context_managers import SettingsOverride
 
 from django.conf import settings
-from django.conf.urls.defaults import patterns
-from django.core.urlresolvers import resolve, Resolver404, reverse
-from django.http import Http404, HttpResponseRedirect
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import Resolver404, reverse
+from django.http import Http404, HttpResponseNotModified, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
 from django.contrib.auth.views import redirect_to_login
-from django.utils.http import urlquote
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe, quote_etag,
+    urlquote)
 
 
 def _handle_no_page(request, slug):
@@ -31,17 +35,54 @@ def _handle_no_page(request, slug):
     raise Http404('CMS: Page not found for "%s"' % slug)
 
 
+def _is_cacheable_request(request):
+    return (request.method in ('GET', 'HEAD') and not request.GET and
+            not request.user.is_authenticated())
+
+
+def _is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return (if_modified_since is not None and last_modified is not None and
+            last_modified <= if_modified_since)
+
+
+def _not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
 def details(request, slug):
     """
     The main view of the Django-CMS! Takes a request and a slug, renders the
     page.
     """
+    cacheable_request = _is_cacheable_request(request)
+    use_page_cache = cacheable_request and is_page_cache_enabled()
+    if use_page_cache:
+        site_id = Site.objects.get_current().pk
+        response = get_page_response(request, site_id, get_language_from_request(request))
+        if response is not None:
+            if (get_cms_setting('PAGE_CONDITIONAL_GET') and response.has_header('ETag') and _is_not_modified(
+                    request, parse_etags(response['ETag'])[0],
+                    parse_http_date_safe(response.get('Last-Modified')))):
+                return _not_modified(response['ETag'])
+            return response
     # get the right model
     context = RequestContext(request)
+    if is_unknown_request_path(request):
+        return _handle_no_page(request, slug)
     # Get a Page model object from the request
     page = get_page_from_request(request, use_path=slug)
 
     if not page:
+        # apphooks are resolved before this view, so this path resolves
+        # neither to a page nor to an application
+        set_unknown_request_path(request)
         return _handle_no_page(request, slug)
 
     current_language = get_language_from_request(request)
@@ -106,13 +147,10 @@ def details(request, slug):
             app_urls = []
         if app_urls:
             app = apphook_pool.get_apphook(app_urls)
-            pattern_list = []
-            for urlpatterns in get_app_urls(app.urls):
-                pattern_list += urlpatterns
-            urlpatterns = patterns('', *pattern_list)
+            resolver = get_app_url_resolver(app_urls)
             try:
                 context.current_app = page.reverse_id if page.reverse_id else app.app_name
-                view, args, kwargs = resolve('/', tuple(urlpatterns))
+                view, args, kwargs = resolver.resolve('/')
                 return view(request, *args, **kwargs)
             except Resolver404:
                 pass
@@ -148,4 +186,22 @@ def details(request, slug):
 
     if not has_view_permissions:
         return _handle_no_page(request, slug)
-    return render_to_response(template_name, context_instance=context)
+
+    # pages which may be cached may also be validated, if enabled
+    cacheable_page = (use_page_cache and not page.login_required and
+                      is_page_cache_enabled(page.get_template()))
+    etag, last_modified = None, None
+    if cacheable_page and get_cms_setting('PAGE_CONDITIONAL_GET'):
+        etag, last_modified = get_page_validators(request, page, current_language)
+        if etag and _is_not_modified(request, etag, last_modified):
+            return _not_modified(quote_etag(etag))
+
+    response = render_to_response(template_name, context_instance=context)
+    # responses containing a csrf token are bound to the visitor's cookie
+    if cacheable_page and not request.META.get('CSRF_COOKIE_USED'):
+        if etag:
+            response['ETag'] = quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        set_page_response(request, site_id, current_language, response)
+    return response
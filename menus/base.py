@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
+import copy
+
 from django.utils.translation import get_language
 from django.utils.encoding import smart_str
 
 
 class Menu(object):
     namespace = None
+    # True if the nodes only depend on which pages the user may see, so users
+    # with the same page visibility can share the cached menu
+    shared_by_visibility = False
     
     def __init__(self):
         if not self.namespace:
@@ -17,10 +22,80 @@ class Menu(object):
         raise NotImplementedError
     
 class Modifier(object):
+    """
+    Modifiers either implement ``modify``, which gets the list of all nodes,
+    or ``start`` and ``visit``, which are called for each node. The menu pool
+    runs consecutive visiting modifiers in a single traversal of the tree.
+    """
     
     def modify(self, request, nodes, namespace, root_id,  post_cut, breadcrumb):
-        pass
-    
+        if _implements_visit(self):
+            return visit_nodes([self], request, nodes, namespace, root_id, post_cut, breadcrumb)
+
+    def start(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+        """
+        Called before the nodes are visited, with the arguments of ``modify``.
+        Return False to not visit the nodes this time.
+        """
+        return True
+
+    def visit(self, node):
+        """
+        Called for every node, parents before their children. Return False to
+        remove the node from the menu.
+        """
+        raise NotImplementedError
+
+
+def _implements_visit(modifier):
+    return getattr(modifier.visit, '__func__', None) is not Modifier.visit.__func__
+
+
+def is_visitor(modifier):
+    # a subclass overriding modify wants to get the whole list, even if one
+    # of its bases implements visit
+    return (_implements_visit(modifier) and
+            getattr(modifier.modify, '__func__', None) is Modifier.modify.__func__)
+
+
+def visit_nodes(modifiers, request, nodes, namespace, root_id, post_cut, breadcrumb):
+    """
+    Runs the given visiting modifiers over the nodes in one depth-first
+    traversal, starting from the nodes without parent. Nodes of the list which
+    can't be reached from those are visited last.
+
+    A node removed by a modifier is not passed to the following modifiers, its
+    children are still visited. It is removed from the list and from the
+    children of its parent once all nodes have been visited.
+    """
+    modifiers = [modifier for modifier in modifiers
+                 if modifier.start(request, nodes, namespace, root_id, post_cut, breadcrumb) is not False]
+    if not modifiers:
+        return nodes
+    seen = set()
+    removed = {}
+    starts = [node for node in nodes if not node.parent] + nodes
+    for start in starts:
+        if id(start) in seen:
+            continue
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            for modifier in modifiers:
+                if modifier.visit(node) is False:
+                    removed[id(node)] = node
+                    break
+            stack.extend(reversed(node.children))
+    if not removed:
+        return nodes
+    parents = dict((id(node.parent), node.parent) for node in removed.values() if node.parent)
+    for parent in parents.values():
+        parent.children = [child for child in parent.children if id(child) not in removed]
+    return [node for node in nodes if id(node) not in removed]
+
 class NavigationNode(object):
     
     def __init__(self, title, url, id, parent_id=None, parent_namespace=None, attr=None, visible=True):
@@ -64,3 +139,223 @@ class NavigationNode(object):
             nodes.append(self.parent)
             nodes += self.parent.get_ancestors()
         return nodes
+
+
+class CompactNavigationNode(NavigationNode):
+    """
+    A node decoded from CompactNodes. Its ``children`` and ``parent`` are
+    decoded when they are accessed.
+    """
+
+    @property
+    def children(self):
+        nodes = self._nodes
+        return [nodes[position] for position in nodes.children[self._position]]
+
+    @property
+    def parent(self):
+        position = self._nodes.parents[self._position]
+        if position is None:
+            return None
+        return self._nodes[position]
+
+
+# the attributes of a plain NavigationNode, which CompactNodes knows to store
+_NODE_ATTRIBUTES = frozenset(['children', 'parent', 'namespace', 'title', 'url', 'id', 'parent_id',
+                              'parent_namespace', 'visible', 'attr'])
+
+
+class CompactNodes(object):
+    """
+    The nodes of a built menu tree, in a form which is smaller and faster to
+    (un)pickle than the nodes themselves, for storing them in the cache.
+
+    The fields of the nodes are kept in parallel arrays: ids, parent ids,
+    titles, urls, an index into a table of (namespace, parent namespace, attr
+    keys) layouts, the visible flag and boolean attr values packed into an int,
+    and a tuple of the other attr values. Nodes are decoded into
+    CompactNavigationNode instances when they are accessed by position.
+
+    Nodes of other classes or with other attributes are stored as they are
+    (without their links) and linked when they are accessed.
+
+    ``children`` and ``parents`` are the positions of the children and of the
+    parent (or None) of each node.
+    """
+    def __init__(self, nodes, children, parents):
+        self.children = children
+        self.parents = parents
+        self.ids = []
+        self.parent_ids = []
+        self.titles = []
+        self.urls = []
+        self.layouts = []
+        self.layout_indices = []
+        self.flags = []
+        self.values = []
+        self.raw = {}
+        self._decoded = {}
+        layout_indices = {}
+        # equal tuples of attr values are stored once
+        interned_values = {}
+        for position, node in enumerate(nodes):
+            attr = getattr(node, 'attr', None)
+            if (node.__class__ is not NavigationNode or not _NODE_ATTRIBUTES.issuperset(node.__dict__)
+                    or not isinstance(node.visible, bool) or not isinstance(attr, dict)):
+                raw = copy.copy(node)
+                raw.children = []
+                raw.parent = None
+                self.raw[position] = raw
+                self._append(None, None, None, None, None, 0, ())
+                continue
+            flags = int(node.visible)
+            values = []
+            keys = []
+            bit = 2
+            for key, value in sorted(node.attr.items()):
+                is_bool = isinstance(value, bool)
+                if is_bool:
+                    if value:
+                        flags |= bit
+                    bit <<= 1
+                else:
+                    values.append(value)
+                keys.append((key, is_bool))
+            layout = (node.namespace, node.parent_namespace, tuple(keys))
+            layout_index = layout_indices.get(layout)
+            if layout_index is None:
+                layout_index = layout_indices[layout] = len(self.layouts)
+                self.layouts.append(layout)
+            values = tuple(values)
+            try:
+                values = interned_values.setdefault(values, values)
+            except TypeError:
+                # unhashable values
+                pass
+            self._append(node.id, node.parent_id, node.title, node.url, layout_index, flags, values)
+
+    def _append(self, id, parent_id, title, url, layout_index, flags, values):
+        self.ids.append(id)
+        self.parent_ids.append(parent_id)
+        self.titles.append(title)
+        self.urls.append(url)
+        self.layout_indices.append(layout_index)
+        self.flags.append(flags)
+        self.values.append(values)
+
+    def __getstate__(self):
+        return (self.children, self.parents, self.ids, self.parent_ids, self.titles, self.urls,
+                self.layouts, self.layout_indices, self.flags, self.values, self.raw)
+
+    def __setstate__(self, state):
+        (self.children, self.parents, self.ids, self.parent_ids, self.titles, self.urls,
+         self.layouts, self.layout_indices, self.flags, self.values, self.raw) = state
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for position in xrange(len(self.ids)):
+            yield self[position]
+
+    def __getitem__(self, position):
+        node = self._decoded.get(position)
+        if node is None:
+            if position < 0:
+                return self[position + len(self.ids)]
+            if position in self.raw:
+                node = self._decode_raw(position)
+            else:
+                node = self._decode(position)
+        return node
+
+    def _decode(self, position):
+        namespace, parent_namespace, keys = self.layouts[self.layout_indices[position]]
+        flags = self.flags[position]
+        values = iter(self.values[position])
+        attr = {}
+        bit = 2
+        for key, is_bool in keys:
+            if is_bool:
+                attr[key] = bool(flags & bit)
+                bit <<= 1
+            else:
+                attr[key] = next(values)
+        node = object.__new__(CompactNavigationNode)
+        node._nodes = self
+        node._position = position
+        node.namespace = namespace
+        node.title = self.titles[position]
+        node.url = self.urls[position]
+        node.id = self.ids[position]
+        node.parent_id = self.parent_ids[position]
+        node.parent_namespace = parent_namespace
+        node.visible = bool(flags & 1)
+        node.attr = attr
+        self._decoded[position] = node
+        return node
+
+    def _decode_raw(self, position):
+        node = copy.copy(self.raw[position])
+        # remember the node before linking it, its relatives link back to it
+        self._decoded[position] = node
+        node.children = [self[child] for child in self.children[position]]
+        parent = self.parents[position]
+        node.parent = self[parent] if parent is not None else None
+        return node
+
+
+class NavigationNodeView(object):
+    """
+    A per-request view of a node of the shared (cached) menu tree, as returned
+    by menu_pool.get_nodes.
+
+    Attributes set on the view (``selected``, ``level``, ...) as well as its
+    ``children`` and ``parent`` belong to the view, all other attributes are
+    read from the shared node. ``attr`` is shared between all requests, assign
+    a new dict instead of modifying it in place.
+    """
+    # set by MenuPool._mark_selected and the Marker modifier
+    selected = False
+    sibling = False
+    ancestor = False
+    descendant = False
+    # set by get_node_views, shadowing the properties of CompactNavigationNode
+    children = None
+    parent = None
+
+    def __getattr__(self, name):
+        # only called for attributes not set on the view itself
+        try:
+            node = self.__dict__['_node']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(node, name)
+
+
+_view_classes = {}
+
+
+def get_node_views(nodes):
+    """
+    Returns views of the given nodes, linked to each other like the nodes.
+    """
+    views = {}
+    for node in nodes:
+        node_class = node.__class__
+        view_class = _view_classes.get(node_class)
+        if view_class is None:
+            # subclass the node's class so its methods work on the view
+            view_class = type(node_class.__name__, (NavigationNodeView, node_class), {})
+            _view_classes[node_class] = view_class
+        view = object.__new__(view_class)
+        view.__dict__['_node'] = node
+        views[id(node)] = view
+    result = []
+    for node in nodes:
+        view = views[id(node)]
+        view.children = [views[id(child)] for child in node.children if id(child) in views]
+        view.parent = views.get(id(node.parent)) if node.parent is not None else None
+        result.append(view)
+    return result
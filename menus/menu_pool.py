@@ -1,68 +1,250 @@
 # -*- coding: utf-8 -*-
+from cms.cache import bump_cache_generation, get_cache_generations
+from cms.cache.page import invalidate_page_cache
 from cms.utils import get_cms_setting
 from cms.utils.django_load import load
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.utils.translation import get_language
+from menus.base import CompactNodes, get_node_views, is_visitor, visit_nodes
 from menus.exceptions import NamespaceAllreadyRegistered
-from menus.models import CacheKey
-import copy
+import hashlib
+import heapq
+import time
+
+# Seconds a process may take to build the nodes of a menu before others stop
+# waiting for it and build them themselves
+BUILD_LOCK_TIMEOUT = 10
+# Seconds between checks whether the nodes being built by another process
+# have been cached
+BUILD_WAIT_INTERVAL = 0.05
+
 
 def _build_nodes_inner_for_one_menu(nodes, menu_class_name):
     '''
     This is an easier to test "inner loop" building the menu tree structure
     for one menu (one language, one site) 
+
+    Nodes are linked to their parents in the order they are given. Nodes
+    whose parent comes later in the list wait for it and are linked in a
+    following round, in their original order. Nodes whose parent never shows
+    up (orphans, circular references) are dropped.
     '''
-    done_nodes = {} # Dict of node.id:Node
+    done_nodes = {} # Dict of namespace: {node.id: Node}
+    waiting = {} # Dict of (namespace, parent_id): [(position, Node)]
     final_nodes = []
-    
-    # This is to prevent infinite loops - we need to compare the number of 
-    # times we see a specific node to "something", and for the time being, 
-    # it's the total number of nodes
-    list_total_length = len(nodes)
-    
-    while nodes:
-        # For when the node has a parent_id but we haven't seen it yet. 
-        # We must not append it to the final list in this case!
-        should_add_to_final_list = True 
-        
-        node = nodes.pop(0)
-        
-        # Increment the "seen" counter for this specific node.
-        node._counter = getattr(node,'_counter',0) + 1  
-        
+    next_round = []
+
+    def link(node, parent):
+        # Implicit parent namespace by menu.__name__
+        if not node.parent_namespace:
+            node.parent_namespace = menu_class_name
+        parent.children.append(node)
+        node.parent = parent
+
+    def add(node):
+        final_nodes.append(node)
+        # add it to the "seen" list
+        done_nodes[node.namespace][node.id] = node
+        return waiting.pop((node.namespace, node.id), ())
+
+    # First round: index all nodes, linking those whose parent was seen
+    # already. This is the only round for well ordered trees.
+    for position, node in enumerate(nodes):
         # Implicit namespacing by menu.__name__
         if not node.namespace:
             node.namespace = menu_class_name
-        if node.namespace not in done_nodes:
-            # We need to create the namespace dict to avoid KeyErrors
-            done_nodes[node.namespace] = {} 
-        
+        namespace_nodes = done_nodes.setdefault(node.namespace, {})
         # If we have seen the parent_id already...
-        if node.parent_id in done_nodes[node.namespace] :
-            # Implicit parent namespace by menu.__name__
-            if not node.parent_namespace:
-                node.parent_namespace = menu_class_name
-            parent = done_nodes[node.namespace][node.parent_id]
-            parent.children.append(node)
-            node.parent = parent
+        if node.parent_id in namespace_nodes:
+            link(node, namespace_nodes[node.parent_id])
         # If it has a parent_id but we haven't seen it yet...
         elif node.parent_id:
-            # We check for infinite loops here, by comparing the number of 
-            # times we "saw" this node to the number of nodes in the list
-            if node._counter < list_total_length:
-                nodes.append(node)
-            # Never add this node to the final list until it has a real 
-            # parent (node.parent)
-            should_add_to_final_list = False
-            
-        if should_add_to_final_list:
-            final_nodes.append(node)
-            # add it to the "seen" list
-            done_nodes[node.namespace][node.id] = node
+            waiting.setdefault((node.namespace, node.parent_id), []).append((position, node))
+            continue
+        # nodes waiting for this one come before it, so they are linked in
+        # the next round
+        next_round.extend(add(node))
+
+    # Following rounds: link waiting nodes once their parent has been added,
+    # in the order they were given.
+    while next_round:
+        current_round = next_round
+        heapq.heapify(current_round)
+        next_round = []
+        while current_round:
+            position, node = heapq.heappop(current_round)
+            link(node, done_nodes[node.namespace][node.parent_id])
+            for child in add(node):
+                if child[0] > position:
+                    heapq.heappush(current_round, child)
+                else:
+                    next_round.append(child)
     return final_nodes
 
+def _get_url_index(nodes):
+    '''
+    Returns a dict mapping the urls of the nodes to the position of the first
+    node with that url, the distinct lengths of these urls, longest first, and
+    the set of urls shared by several nodes.
+    '''
+    urls = {}
+    duplicates = set()
+    for position, node in enumerate(nodes):
+        url = node.get_absolute_url()
+        if url is None:
+            continue
+        if url in urls:
+            duplicates.add(url)
+        else:
+            urls[url] = position
+    lengths = sorted(set(len(url) for url in urls), reverse=True)
+    return urls, lengths, duplicates
+
+
+def get_namespace_index(nodes):
+    '''
+    Returns a dict mapping each namespace to the positions of its nodes without
+    parent_id (the roots of the namespace) and the positions of all its nodes.
+    '''
+    index = {}
+    for position, node in enumerate(nodes):
+        roots, members = index.setdefault(node.namespace, ([], []))
+        if not node.parent_id:
+            roots.append(position)
+        members.append(position)
+    return index
+
+
+def _get_tree_index(nodes):
+    '''
+    Returns the positions of the nodes without parent, the positions of the
+    children and of the parent (or None) of each node, and a dict mapping
+    reverse ids to the position of the first node with that reverse_id.
+    '''
+    positions = dict((id(node), position) for position, node in enumerate(nodes))
+    roots = []
+    children = []
+    parents = []
+    reverse_ids = {}
+    for position, node in enumerate(nodes):
+        if node.parent is None:
+            roots.append(position)
+            parents.append(None)
+        else:
+            parents.append(positions[id(node.parent)])
+        children.append([positions[id(child)] for child in node.children])
+        reverse_id = node.attr.get('reverse_id')
+        if reverse_id and reverse_id not in reverse_ids:
+            reverse_ids[reverse_id] = position
+    return roots, children, parents, reverse_ids
+
+
+def _get_bounded_positions(nodes, tree_index, selected, root, levels):
+    '''
+    Returns the sorted positions of the nodes which may survive cutting the
+    menu to ``levels`` (from_level, to_level, extra_inactive, extra_active,
+    see menus.templatetags.menu_tags.cut_levels) after the modifiers ran.
+    ``selected`` is the position of the selected node, ``root`` the position
+    of the node the menu is shown below (root_id), both may be None.
+
+    Nodes are kept by their distance to the closest ancestor on the selected
+    path (or to the root node): distances don't change when a modifier cuts
+    the tree at a soft root, or attaches it below another node. One more
+    level than needed is kept, so modifiers still see whether the deepest
+    nodes have children. If a modifier attaches the tree of the selected node
+    elsewhere, these bounds don't hold: MenuPool.get_nodes then builds the
+    whole menu instead.
+    '''
+    roots, children, parents, reverse_ids = tree_index
+    from_level, to_level, extra_inactive, extra_active = levels
+    bound = max(from_level, to_level)
+    if from_level:
+        # nodes on from_level are shown even if their ancestors are cut off,
+        # so only the levels bound the menu
+        extra_inactive = extra_active = bound
+    if root is not None:
+        # levels are counted from the children of the root node
+        bound += 1
+    # the nodes on the selected path and above the root node, with the
+    # distance their descendants are kept to
+    anchors = {}
+    below_selected = False
+    position = root
+    while position is not None:
+        anchors[position] = min(bound, extra_inactive + 1) + 1
+        if position == selected:
+            # all nodes shown are descendants of the selected node, which
+            # isn't shown itself (and doesn't cut its descendants)
+            below_selected = True
+        position = parents[position]
+    if below_selected:
+        extra_active = bound
+    position = selected
+    while position is not None:
+        anchors[position] = min(bound, extra_inactive + 1) + 1
+        position = parents[position]
+    if selected is None:
+        inactive = min(bound, extra_inactive) + 1
+        others = inactive
+    else:
+        anchors[selected] = min(bound, extra_active) + 1
+        if below_selected:
+            anchors[root] = bound + 1
+        inactive = min(bound, extra_inactive) + 1
+        # other menus may be attached below the selected node
+        others = min(bound, max(extra_inactive, extra_active)) + 1
+        namespace = nodes[selected].namespace
+    kept = []
+    for position in roots:
+        if position in anchors:
+            remaining = anchors[position]
+        elif selected is None or nodes[position].namespace == namespace:
+            remaining = inactive
+        else:
+            remaining = others
+        stack = [(position, remaining)]
+        while stack:
+            position, remaining = stack.pop()
+            kept.append(position)
+            for child in children[position]:
+                if child in anchors:
+                    stack.append((child, anchors[child]))
+                elif remaining > 0:
+                    stack.append((child, remaining - 1))
+    kept.sort()
+    return kept
+
+
+class IndexedNodes(list):
+    '''
+    The nodes handed to the modifiers by MenuPool.get_nodes, along with the
+    indexes of the cached tree. The indexes hold positions in this list, so
+    they are dropped as soon as the list is changed.
+    '''
+    def __init__(self, nodes, namespace_index):
+        super(IndexedNodes, self).__init__(nodes)
+        self.namespace_index = namespace_index
+
+    def get_namespace_index(self):
+        return self.namespace_index
+
+
+def _invalidate_index(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.namespace_index = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__',
+             'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(IndexedNodes, name, _invalidate_index(name))
+
+
 class MenuPool(object):
     def __init__(self):
         self.menus = {}
@@ -81,14 +263,44 @@ class MenuPool(object):
         '''
         This invalidates the cache for a given menu (site_id and language)
         '''
-        if all:
-            cache_keys = CacheKey.objects.get_keys()
+        if all or (not site_id and not language):
+            key = self._get_generation_key()
+        elif not site_id:
+            key = self._get_generation_key(language=language)
+        elif not language:
+            key = self._get_generation_key(site_id=site_id)
         else:
-            cache_keys = CacheKey.objects.get_keys(site_id, language)        
-        to_be_deleted = cache_keys.distinct().values_list('key', flat=True)
-        cache.delete_many(to_be_deleted)
-        cache_keys.delete()
-    
+            key = self._get_generation_key(site_id, language)
+        bump_cache_generation(key, get_cms_setting('CACHE_DURATIONS')['menus'])
+        # rendered pages contain the menus
+        invalidate_page_cache()
+
+    def _get_generation_key(self, site_id=None, language=None):
+        prefix = getattr(settings, "CMS_CACHE_PREFIX", "menu_cache_")
+        return "%smenu_nodes_generation_%s_%s" % (prefix, language or '', site_id or '')
+
+    def _get_cache_key(self, request, site_id, lang):
+        prefix = getattr(settings, "CMS_CACHE_PREFIX", "menu_cache_")
+        key = "%smenu_nodes_%s_%s" % (prefix, lang, site_id)
+        if request.user.is_authenticated():
+            if all(menu.shared_by_visibility for menu in self.menus.values()):
+                # users seeing the same pages share their menu
+                from cms.utils.permissions import get_visibility_fingerprint
+                key += "_%s_visibility" % get_visibility_fingerprint(request, site_id)
+            else:
+                key += "_%s_user" % request.user.pk
+        # Menus are invalidated per site, per language or per site and
+        # language by bumping one of these generations
+        generations = get_cache_generations([
+            self._get_generation_key(),
+            self._get_generation_key(site_id=site_id),
+            self._get_generation_key(language=lang),
+            self._get_generation_key(site_id, lang),
+        ], get_cms_setting('CACHE_DURATIONS')['menus'])
+        if generations:
+            key += "_%s" % "_".join(str(generation) for generation in generations)
+        return key
+
     def register_menu(self, menu):
         from menus.base import Menu
         assert issubclass(menu, Menu)
@@ -119,65 +331,253 @@ class MenuPool(object):
                 set the node as the node's parent's child (re-read this)
             else:
                 the node is put at the bottom of the list
+
+        Returns the nodes, their url index (see _get_url_index), their
+        namespace index (see get_namespace_index) and their tree index (see
+        _get_tree_index).
         """
         # Cache key management
         lang = get_language()
-        prefix = getattr(settings, "CMS_CACHE_PREFIX", "menu_cache_")
-        key = "%smenu_nodes_%s_%s" % (prefix, lang, site_id)
-        if request.user.is_authenticated():
-            key += "_%s_user" % request.user.pk
+        key = self._get_cache_key(request, site_id, lang)
         cached_nodes = cache.get(key, None)
         if cached_nodes:
             return cached_nodes
-        
+        # only one process builds the nodes, the others wait for them
+        lock_key = "%s_lock" % key
+        locked = cache.add(lock_key, True, BUILD_LOCK_TIMEOUT)
+        if not locked:
+            deadline = time.time() + BUILD_LOCK_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(BUILD_WAIT_INTERVAL)
+                cached_nodes = cache.get(key, None)
+                if cached_nodes:
+                    return cached_nodes
+                if cache.get(lock_key) is None:
+                    # the build failed, take over
+                    locked = cache.add(lock_key, True, BUILD_LOCK_TIMEOUT)
+                    break
+        try:
+            return self._build_and_cache_nodes(request, key)
+        finally:
+            # only the process holding the lock may release it
+            if locked:
+                cache.delete(lock_key)
+
+    def _build_and_cache_nodes(self, request, key):
         final_nodes = []
         for menu_class_name in self.menus:
             nodes = self.menus[menu_class_name].get_nodes(request)
             # nodes is a list of navigation nodes (page tree in cms + others)
             final_nodes += _build_nodes_inner_for_one_menu(nodes, menu_class_name)
-        cache.set(key, final_nodes, get_cms_setting('CACHE_DURATIONS')['menus'])
-        # We need to have a list of the cache keys for languages and sites that
-        # span several processes - so we follow the Django way and share through 
-        # the database. It's still cheaper than recomputing every time!
-        # This way we can selectively invalidate per-site and per-language, 
-        # since the cache shared but the keys aren't 
-        CacheKey.objects.get_or_create(key=key, language=lang, site=site_id)
-        return final_nodes
-
-    def apply_modifiers(self, nodes, request, namespace=None, root_id=None, post_cut=False, breadcrumb=False):
+        # the url index is used to find the selected node, the namespace index
+        # to attach navigation extenders, the tree index to build only parts
+        # of the menu
+        tree_index = _get_tree_index(final_nodes)
+        roots, children, parents, reverse_ids = tree_index
+        cached_nodes = (CompactNodes(final_nodes, children, parents), _get_url_index(final_nodes),
+                        get_namespace_index(final_nodes), tree_index)
+        cache.set(key, cached_nodes, get_cms_setting('CACHE_DURATIONS')['menus'])
+        return cached_nodes
+
+    def warm(self, languages=None):
+        '''
+        Builds the menus of the current site for anonymous visitors in the
+        given languages (all languages of the site by default), unless they
+        are cached already. Returns the languages.
+        '''
+        from cms.utils.i18n import force_language, get_language_list
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpRequest
+        from django.utils.datastructures import MergeDict
+
+        self.discover_menus()
+        site_id = Site.objects.get_current().pk
+        if not languages:
+            languages = get_language_list(site_id)
+        for language in languages:
+            request = HttpRequest()
+            request.method = 'GET'
+            request.path = request.path_info = '/'
+            request.REQUEST = MergeDict(request.POST, request.GET)
+            request.user = AnonymousUser()
+            request.session = {}
+            request.LANGUAGE_CODE = language
+            with force_language(language):
+                self._build_nodes(request, site_id)
+        return languages
+
+    def apply_modifiers(self, nodes, request, namespace=None, root_id=None, post_cut=False, breadcrumb=False,
+                        url_index=None):
         if not post_cut:
-            nodes = self._mark_selected(request, nodes)
+            nodes = self._mark_selected(request, nodes, url_index)
+        # consecutive visiting modifiers share one traversal of the nodes
+        visitors = []
         for cls in self.modifiers:
             inst = cls()
+            if is_visitor(inst):
+                visitors.append(inst)
+                continue
+            if visitors:
+                nodes = visit_nodes(visitors, request, nodes, namespace, root_id, post_cut, breadcrumb)
+                visitors = []
             nodes = inst.modify(request, nodes, namespace, root_id, post_cut, breadcrumb)
+        if visitors:
+            nodes = visit_nodes(visitors, request, nodes, namespace, root_id, post_cut, breadcrumb)
         return nodes
 
-    def get_nodes(self, request, namespace=None, root_id=None, site_id=None, breadcrumb=False):
+    def get_nodes(self, request, namespace=None, root_id=None, site_id=None, breadcrumb=False, levels=None):
+        '''
+        Returns the nodes of the menu, after the modifiers ran.
+
+        ``levels`` is the (from_level, to_level, extra_inactive, extra_active)
+        the menu is going to be cut to (see cut_levels in menus.templatetags.
+        menu_tags). If CMS_MENU_BOUNDED_NODES is enabled, only the nodes that
+        may survive this cut are returned then, along with the nodes on the
+        selected path.
+        '''
         self.discover_menus()
         if not site_id:
             site_id = Site.objects.get_current().pk
-        nodes = self._build_nodes(request, site_id)
-        nodes = copy.deepcopy(nodes)
-        nodes = self.apply_modifiers(nodes, request, namespace, root_id, post_cut=False, breadcrumb=breadcrumb)
+        nodes, url_index, namespace_index, tree_index = self._build_nodes(request, site_id)
+        if levels is not None and get_cms_setting('MENU_BOUNDED_NODES'):
+            bounded = self._get_bounded_nodes(request, nodes, url_index, tree_index, namespace, root_id,
+                                              breadcrumb, levels)
+            if bounded is not None:
+                return bounded
+        # the built nodes are shared, modifiers work on views of them
+        nodes = IndexedNodes(get_node_views(nodes), namespace_index)
+        nodes = self.apply_modifiers(nodes, request, namespace, root_id, post_cut=False, breadcrumb=breadcrumb,
+                                     url_index=url_index)
         return nodes 
 
-    def _mark_selected(self, request, nodes):
-        sel = None
-        for node in nodes:
-            node.sibling = False
-            node.ancestor = False
-            node.descendant = False
-            node.selected = False
-            if node.get_absolute_url() == request.path[:len(node.get_absolute_url())]:
-                if sel:
-                    if len(node.get_absolute_url()) > len(sel.get_absolute_url()):
-                        sel = node
-                else:
-                    sel = node
+    def _get_bounded_nodes(self, request, nodes, url_index, tree_index, namespace, root_id, breadcrumb, levels):
+        '''
+        Returns the modified views of the nodes which may survive cutting to
+        ``levels``, or None if the whole menu needs to be built.
+        '''
+        selected = self._get_selected_position(request, url_index)
+        root = None
+        if root_id:
+            root = tree_index[3].get(root_id)
+            if root is None:
+                return None
+        positions = _get_bounded_positions(nodes, tree_index, selected, root, levels)
+        views = self.apply_modifiers(get_node_views([nodes[position] for position in positions]), request,
+                                     namespace, root_id, post_cut=False, breadcrumb=breadcrumb)
+        # the bounds only hold if the selected node kept its ancestors
+        if not self._kept_selected_path(views, nodes, tree_index, selected):
+            return None
+        return views
+
+    def _kept_selected_path(self, views, nodes, tree_index, selected):
+        '''
+        Returns False if the modifiers removed the selected node (at position
+        ``selected`` of the built nodes) or attached it to new ancestors.
+        '''
+        if selected is None:
+            return True
+        path = set()
+        position = selected
+        while position is not None:
+            path.add(id(nodes[position]))
+            position = tree_index[2][position]
+        selected_views = [view for view in views if view.selected]
+        if not selected_views:
+            return False
+        view = selected_views[0]
+        while view is not None:
+            if id(view._node) not in path:
+                return False
+            view = view.parent
+        return True
+
+    def get_breadcrumb_nodes(self, request, home_url):
+        '''
+        Returns the nodes of get_nodes(request, breadcrumb=True) a breadcrumb
+        needs. If CMS_MENU_BOUNDED_NODES is enabled, these are only the
+        selected node, its ancestors and the node with the url ``home_url``.
+        All nodes are returned if the selected node is part of a menu attached
+        to another one (e.g. by navigation extenders), or if several nodes
+        have the home url.
+        '''
+        self.discover_menus()
+        site_id = Site.objects.get_current().pk
+        if not get_cms_setting('MENU_BOUNDED_NODES'):
+            return self.get_nodes(request, site_id=site_id, breadcrumb=True)
+        nodes, url_index, namespace_index, tree_index = self._build_nodes(request, site_id)
+        urls, duplicates = url_index[0], url_index[2]
+        if home_url not in duplicates:
+            selected = self._get_selected_position(request, url_index)
+            positions = set()
+            position = selected
+            while position is not None:
+                positions.add(position)
+                position = tree_index[2][position]
+            if home_url in urls:
+                positions.add(urls[home_url])
+            views = self.apply_modifiers(get_node_views([nodes[position] for position in sorted(positions)]),
+                                         request, breadcrumb=True)
+            if self._kept_selected_path(views, nodes, tree_index, selected):
+                return views
+        return self.get_nodes(request, site_id=site_id, breadcrumb=True)
+
+    def get_fragment_cache_key(self, request, name, arguments):
+        '''
+        Returns the key to cache the output of the menu tag ``name`` rendered
+        with ``arguments`` (a dict) under. Requests seeing the same menu with
+        the same node selected share it, and menu_pool.clear invalidates it.
+
+        The selected node of a path is cached next to the menu, so the menu
+        itself is only needed the first time a path is seen.
+        '''
+        self.discover_menus()
+        site_id = Site.objects.get_current().pk
+        prefix = self._get_cache_key(request, site_id, get_language())
+        selected_key = "%s_selected_%s" % (prefix, hashlib.md5(request.path.encode('utf-8')).hexdigest())
+        selected = cache.get(selected_key)
+        if selected is None:
+            nodes, url_index = self._build_nodes(request, site_id)[:2]
+            position = self._get_selected_position(request, url_index)
+            if position is None:
+                selected = ()
             else:
+                selected = (nodes[position].namespace, nodes[position].id)
+            cache.set(selected_key, selected, get_cms_setting('CACHE_DURATIONS')['menus'])
+        arguments = sorted(arguments.items())
+        digest = hashlib.md5(repr((name, selected, arguments)).encode('utf-8')).hexdigest()
+        return "%s_fragment_%s" % (prefix, digest)
+
+    def _get_selected_position(self, request, url_index):
+        '''
+        Returns the position of the node with the longest url the request path
+        starts with, or None.
+        '''
+        urls, lengths = url_index[:2]
+        path = request.path
+        for length in lengths:
+            if length <= len(path):
+                position = urls.get(path[:length])
+                if position is not None:
+                    return position
+        return None
+
+    def _mark_selected(self, request, nodes, url_index=None):
+        '''
+        Selects the node with the longest url the request path starts with.
+
+        With a url_index, nodes are expected to be fresh views, which aren't
+        marked yet.
+        '''
+        if url_index is None:
+            for node in nodes:
+                node.sibling = False
+                node.ancestor = False
+                node.descendant = False
                 node.selected = False
-        if sel:
-            sel.selected = True
+            url_index = _get_url_index(nodes)
+        position = self._get_selected_position(request, url_index)
+        if position is not None:
+            nodes[position].selected = True
         return nodes
 
     def get_menus_by_attribute(self, name, value):
@@ -10,41 +10,42 @@ class Marker(Modifier):
     descendants: descendant = True
     ancestors: ancestor = True
     """
-    def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+    def start(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
         if post_cut or breadcrumb:
-            return nodes
-        selected = None
-        root_nodes = []
-        for node in nodes:
-            if not hasattr(node, "descendant"):
-                node.descendant = False
-            if not hasattr(node, "ancestor"):
-                node.ancestor = False
-            if not node.parent:
-                if selected and not selected.parent:
-                    node.sibling = True
-                root_nodes.append(node)
-            if node.selected: 
-                if node.parent:
-                    newnode = node
-                    while newnode.parent:
-                        newnode = newnode.parent
-                        newnode.ancestor = True
-                    for sibling in node.parent.children:
-                        if not sibling.selected:
-                            sibling.sibling = True
-                else:
-                    for root_node in root_nodes:
-                        if not root_node.selected:
-                            root_node.sibling = True
-                if node.children:                    
-                    self.mark_descendants(node.children)
-                selected = node
-            if node.children:
-                node.is_leaf_node = False
+            return False
+        self.selected = None
+        self.root_nodes = []
+
+    def visit(self, node):
+        selected = self.selected
+        if not hasattr(node, "descendant"):
+            node.descendant = False
+        if not hasattr(node, "ancestor"):
+            node.ancestor = False
+        if not node.parent:
+            if selected and not selected.parent:
+                node.sibling = True
+            self.root_nodes.append(node)
+        if node.selected: 
+            if node.parent:
+                newnode = node
+                while newnode.parent:
+                    newnode = newnode.parent
+                    newnode.ancestor = True
+                for sibling in node.parent.children:
+                    if not sibling.selected:
+                        sibling.sibling = True
             else:
-                node.is_leaf_node = True
-        return nodes
+                for root_node in self.root_nodes:
+                    if not root_node.selected:
+                        root_node.sibling = True
+            if node.children:                    
+                self.mark_descendants(node.children)
+            self.selected = node
+        if node.children:
+            node.is_leaf_node = False
+        else:
+            node.is_leaf_node = True
                 
     def mark_descendants(self, nodes):
         for node in nodes:
@@ -59,28 +60,29 @@ class Level(Modifier):
     """
     post_cut = True
     
-    def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+    def start(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
         if breadcrumb:
-            return nodes
-        for node in nodes:
-            
-            if not node.parent:
-                if post_cut:
-                    node.menu_level = 0
-                else:
-                    node.level = 0
-                self.mark_levels(node, post_cut)
-                
-        return nodes
-            
-                    
-    def mark_levels(self, node, post_cut):
-        for child in node.children:
-            if post_cut:
-                child.menu_level = node.menu_level + 1
+            return False
+        self._post_cut = post_cut
+        # nodes reached from a root node
+        self.marked = set()
+
+    def visit(self, node):
+        parent = node.parent
+        if not parent:
+            level = 0
+        elif id(parent) in self.marked:
+            if self._post_cut:
+                level = parent.menu_level + 1
             else:
-                child.level = node.level + 1
-            self.mark_levels(child, post_cut)
+                level = parent.level + 1
+        else:
+            return
+        if self._post_cut:
+            node.menu_level = level
+        else:
+            node.level = level
+        self.marked.add(id(node))
 
 
 
@@ -88,24 +90,21 @@ class AuthVisibility(Modifier):
     """
     Remove nodes that are login required or require a group
     """
-    def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
+    def start(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
         if post_cut or breadcrumb:
-            return nodes
-        final = []
-        for node in nodes:
-            if (node.attr.get('visible_for_authenticated', True) and \
-                 request.user.is_authenticated()) or \
-                (node.attr.get('visible_for_anonymous', True) and \
-                 not request.user.is_authenticated()):
-                final.append(node)
-            else:
-                if node.parent and node in node.parent.children:
-                    node.parent.children.remove(node)
-        return final
+            return False
+        self.is_authenticated = request.user.is_authenticated()
+
+    def visit(self, node):
+        if self.is_authenticated:
+            visible = node.attr.get('visible_for_authenticated', True)
+        else:
+            visible = node.attr.get('visible_for_anonymous', True)
+        if not visible:
+            return False
 
 
 def register():
     menu_pool.register_modifier(Marker)
     menu_pool.register_modifier(AuthVisibility)
     menu_pool.register_modifier(Level)
-    
\ No newline at end of file
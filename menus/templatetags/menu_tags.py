@@ -5,6 +5,7 @@ import urllib
 from classytags.arguments import IntegerArgument, Argument, StringArgument
 from classytags.core import Options
 from classytags.helpers import InclusionTag
+from cms.utils import get_cms_setting
 from cms.utils.i18n import force_language, get_language_objects
 from django import template
 from django.conf import settings
@@ -93,7 +94,30 @@ def flatten(nodes):
     return flat
 
 
-class ShowMenu(InclusionTag):
+class MenuFragmentCacheMixin(object):
+    """
+    Caches the rendered output of the tag if CMS_MENU_FRAGMENT_CACHE is set.
+    The output is shared by all requests seeing the same menu with the same
+    node selected, so the template must not use anything else.
+
+    When the output comes from the cache, get_context isn't called, so the
+    tag doesn't add ``children`` (or ``ancestors``) and the other variables
+    to the context.
+    """
+    def render_tag(self, context, **kwargs):
+        request = context.get('request', None)
+        if (request is None or not get_cms_setting('MENU_FRAGMENT_CACHE') or
+                kwargs.get('next_page', None)):
+            return super(MenuFragmentCacheMixin, self).render_tag(context, **kwargs)
+        key = menu_pool.get_fragment_cache_key(request, self.name, kwargs)
+        output = cache.get(key)
+        if output is None:
+            output = super(MenuFragmentCacheMixin, self).render_tag(context, **kwargs)
+            cache.set(key, output, get_cms_setting('CACHE_DURATIONS')['menus'])
+        return output
+
+
+class ShowMenu(MenuFragmentCacheMixin, InclusionTag):
     """
     render a nested list of all children of the pages
     - from_level: starting level
@@ -130,7 +154,8 @@ class ShowMenu(InclusionTag):
             children = next_page.children
         else:
         #new menu... get all the data so we can save a lot of queries
-            nodes = menu_pool.get_nodes(request, namespace, root_id)
+            nodes = menu_pool.get_nodes(request, namespace, root_id,
+                                        levels=(from_level, to_level, extra_inactive, extra_active))
             if root_id: # find the root id and cut the nodes
                 id_nodes = menu_pool.get_nodes_by_attribute(nodes, "reverse_id", root_id)
                 if id_nodes:
@@ -179,7 +204,7 @@ class ShowMenuBelowId(ShowMenu):
 register.tag(ShowMenuBelowId)
 
 
-class ShowSubMenu(InclusionTag):
+class ShowSubMenu(MenuFragmentCacheMixin, InclusionTag):
     """
     show the sub menu of the current nav-node.
     - levels: how many levels deep
@@ -247,7 +272,7 @@ class ShowSubMenu(InclusionTag):
 register.tag(ShowSubMenu)
 
 
-class ShowBreadcrumb(InclusionTag):
+class ShowBreadcrumb(MenuFragmentCacheMixin, InclusionTag):
     """
     Shows the breadcrumb from the node that has the same url as the current request
     
@@ -278,13 +303,14 @@ class ShowBreadcrumb(InclusionTag):
         except:
             only_visible = bool(only_visible)
         ancestors = []
-        nodes = menu_pool.get_nodes(request, breadcrumb=True)
+        home_url = urllib.unquote(reverse("pages-root"))
+        nodes = menu_pool.get_breadcrumb_nodes(request, home_url)
         selected = None
         home = None
         for node in nodes:
             if node.selected:
                 selected = node
-            if node.get_absolute_url() == urllib.unquote(reverse("pages-root")):
+            if node.get_absolute_url() == home_url:
                 home = node
         if selected and selected != home:
             node = selected